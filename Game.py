@@ -1,11 +1,27 @@
-"""Game.py - This file contains the class definitions for Game, GameForm, GameForms. The class Game
-has three methods, namely 'new_game', 'to_game_form' and 'end_game'."""
+"""Game.py - This file contains the class definitions for Game, ArchivedGame, GameForm,
+GameForms, MoveForm and GameHistoryForm. The class Game has methods 'new_game', 'new_games',
+'get_engine', 'is_won', 'make_guess', 'save_move', 'cancel', 'get_moves', 'to_history_form',
+'get_state', 'cache_state', 'to_game_form' and 'end_game'. The methods writing to the
+datastore also have a tasklet version with the '_async' suffix. The guesses are evaluated by
+the HangmanEngine defined in engine.py and the moves are stored encoded by history.py.
+Finished games are replaced by an ArchivedGame summary by the archival task of main.py."""
 
-import random
+import collections
+import datetime
 from protorpc import messages
 from google.appengine.ext import ndb
 from User import *
 from Score import *
+import engine
+from words import get_library
+from history import encode_move, decode_moves, parse_legacy
+from utils import chunks
+from counters import random_shard_key, apply_update, update_active_games
+from highscores import record_win
+import gamecache
+
+# Maximum number of entity groups of a cross-group transaction
+XG_ENTITY_GROUPS = 25
 
 class Game(ndb.Model):
     """Game object"""
@@ -16,51 +32,323 @@ class Game(ndb.Model):
     letters_right_position = ndb.StringProperty(required=True, default='')
     game_over = ndb.BooleanProperty(required=True, default=False)
     user = ndb.KeyProperty(required=True, kind='User')
-    history = ndb.PickleProperty(required=True, default=[])
+    # Copy of the user name so that forms can be built without fetching the user
+    user_name = ndb.StringProperty(indexed=False)
+    # English sentences of the moves of games created before move_log existed
+    history = ndb.PickleProperty()
+    # Moves encoded by history.py, appended to by every move
+    move_log = ndb.BlobProperty(default='')
+    # Bitmasks of the letters guessed and of the revealed positions of the word
+    guessed_mask = ndb.IntegerProperty(default=0, indexed=False)
+    revealed_mask = ndb.IntegerProperty(default=0, indexed=False)
+    # Bumped by every move, identifies the state cached by gamecache.py
+    version = ndb.IntegerProperty(default=0, indexed=False)
+    # When the game ended, finished games are archived some time after
+    ended = ndb.DateTimeProperty()
+    # Result of the game, set when it ends
+    won = ndb.BooleanProperty(indexed=False)
+
+    @classmethod
+    def new_game(cls,user,attempts,min_length=None,max_length=None,difficulty=None):
+        """Creates and returns a new game for the given User. The word to guess is chosen from the
+        word library, optionally filtered by length and difficulty. Raises
+        ValueError if no word matches the filters"""
+        return cls.new_game_async(user, attempts, min_length, max_length,
+                                  difficulty).get_result()
 
     @classmethod
-    def new_game(cls,user,attempts):
-        """Creates and returns a new game"""
-        # List of words to choose ad the original word. This list can be external library or given words list.
-        words_to_guess = ["beautiful","extraordinary","spectacular","mountain","fabulous","wonderful"]
-        # pick a number to choose from the words
-        number = random.randint(0,5)
-        word_to_guess = str(words_to_guess[number])
+    @ndb.tasklet
+    def new_game_async(cls,user,attempts,min_length=None,max_length=None,difficulty=None):
+        """Tasklet version of 'new_game'"""
+        word_to_guess = str(get_library().random_word(min_length, max_length, difficulty))
         attempts_default = 9
-        game = Game(user=user,
+        game = Game(user=user.key,
+                    user_name=user.name,
                     word_to_guess=word_to_guess,
                     letters_guessed='',
-                    letters_right_position = '',
-                    history=[],
+                    letters_right_position = '_ ' * len(word_to_guess),
                     attempts_allowed=attempts_default,
                     attempts_remaining=attempts_default,
                     game_over=False)
-        game.put()
-        return game
-    
-    def to_game_form(self,message):
+        shard_key = random_shard_key()
+
+        @ndb.tasklet
+        def txn():
+            # The game is written while the aggregate shard and the player are read
+            _, shard, player = yield (game.put_async(), shard_key.get_async(),
+                                      user.key.get_async())
+            entities = [apply_update(shard_key, shard, game.attempts_remaining, 1)]
+            if player:
+                player.active_games += 1
+                entities.append(player)
+            yield ndb.put_multi_async(entities)
+        yield ndb.transaction_async(txn, xg=True)
+        raise ndb.Return(game)
+
+    @classmethod
+    def new_games(cls,users,attempts,min_length=None,max_length=None,difficulty=None):
+        """Creates and returns one new game for every User of the list, with
+        one put_multi per BULK_CHUNK_SIZE games. The count of active games of
+        the players is then incremented in transactions of at most
+        XG_ENTITY_GROUPS players, and the active games aggregate once.
+        Raises ValueError if no word matches the filters"""
+        library = get_library()
+        games = []
+        for user in users:
+            word_to_guess = str(library.random_word(min_length, max_length, difficulty))
+            games.append(Game(user=user.key,
+                              user_name=user.name,
+                              word_to_guess=word_to_guess,
+                              letters_guessed='',
+                              letters_right_position = '_ ' * len(word_to_guess),
+                              attempts_allowed=attempts,
+                              attempts_remaining=attempts,
+                              game_over=False))
+        for chunk in chunks(games, BULK_CHUNK_SIZE):
+            ndb.put_multi(chunk)
+        started = collections.Counter(user.key for user in users)
+
+        @ndb.tasklet
+        def update_players(keys):
+            @ndb.tasklet
+            def txn():
+                # Read again in the transaction so that a concurrent
+                # end_game of a player is not overwritten
+                players = yield ndb.get_multi_async(keys)
+                players = [player for player in players if player]
+                for player in players:
+                    player.active_games += started[player.key]
+                yield ndb.put_multi_async(players)
+            yield ndb.transaction_async(txn, xg=True)
+        # One transaction per XG_ENTITY_GROUPS players, run concurrently
+        futures = [update_players(chunk)
+                   for chunk in chunks(list(started), XG_ENTITY_GROUPS)]
+        for future in futures:
+            future.get_result()
+        if games:
+            update_active_games(sum(game.attempts_remaining for game in games),
+                                len(games))
+        return games
+
+    def get_engine(self):
+        """Returns a HangmanEngine holding the state of the game"""
+        guessed = self.guessed_mask
+        revealed = self.revealed_mask
+        if not guessed and self.letters_guessed:
+            # Games created before the masks were stored
+            guessed = engine.letters_to_mask(self.letters_guessed)
+            revealed = engine.revealed_mask(self.word_to_guess, guessed)
+        return engine.HangmanEngine(self.word_to_guess, guessed, revealed,
+                                    self.attempts_remaining)
+
+    def is_won(self):
+        """True if the game is over and was won. A game that ended before
+        the result was stored was lost exactly when no attempt was left"""
+        if self.won is not None:
+            return self.won
+        return self.game_over and self.attempts_remaining > 0
+
+    @property
+    def word_found(self):
+        """True if every letter of the word has been revealed"""
+        return self.revealed_mask == (1 << len(self.word_to_guess)) - 1
+
+    def make_guess(self, guess):
+        """Applies a guess to the game without saving it. Returns the
+        outcome of the guess as one of the constants of engine.py"""
+        word = self.word_to_guess
+        if len(guess) == 1 and len(word) != 1 and \
+                (self.guessed_mask or not self.letters_guessed):
+            # Letter guesses on the stored masks, without building an engine
+            outcome, guessed, revealed = engine.guess_letter(
+                word, self.guessed_mask, self.revealed_mask, guess)
+            if outcome in (engine.INVALID, engine.REPEATED):
+                return outcome
+            guess = guess.lower().encode('ascii')
+            self.version += 1
+            self.move_log += encode_move(guess, outcome)
+            self.letters_guessed += guess
+            self.guessed_mask = guessed
+            if outcome == engine.HIT:
+                self.revealed_mask = revealed
+                self.letters_right_position = engine.render_pattern(word, revealed)
+            else:
+                self.attempts_remaining -= 1
+            return outcome
+        state = self.get_engine()
+        outcome = state.guess(guess)
+        if outcome in (engine.INVALID, engine.REPEATED):
+            return outcome
+        # The engine only accepts ASCII letters, so this cannot fail
+        guess = guess.lower().encode('ascii')
+        self.version += 1
+        self.move_log += encode_move(guess, outcome)
+        if outcome in (engine.HIT, engine.MISS):
+            self.letters_guessed += guess
+            if outcome == engine.HIT:
+                self.letters_right_position = state.pattern()
+        self.guessed_mask = state.guessed
+        self.revealed_mask = state.revealed
+        self.attempts_remaining = state.attempts_remaining
+        return outcome
+
+    def get_moves(self):
+        """Returns the list of (guess, result) tuples of the moves. The moves
+        are only decoded when the history is requested"""
+        return parse_legacy(self.history or []) + decode_moves(self.move_log)
+
+    def to_history_form(self):
+        """Returns a GameHistoryForm of the moves of the Game"""
+        return GameHistoryForm(items=[MoveForm(guess=guess, result=result)
+                                      for guess, result in self.get_moves()])
+
+    def get_state(self, user_name=None):
+        """Returns the dict of the GameForm fields of the state of the Game"""
+        if user_name is None:
+            user_name = self.user_name or self.user.get().name
+        return dict(user_name=user_name,
+                    letters_guessed=self.letters_guessed,
+                    attempts_remaining=self.attempts_remaining,
+                    game_over=self.game_over,
+                    version=self.version)
+
+    def cache_state(self):
+        """Caches the state of the saved Game for 'get_game'. Returns the state"""
+        state = self.get_state()
+        gamecache.set_state(self.key.urlsafe(), state)
+        return state
+
+    def to_game_form(self,message,user_name=None):
         """Returns a GameForm representation of the Game"""
-        return GameForm(urlsafe_key = self.key.urlsafe(),
-                                    user_name = self.user.get().name,
-                                    letters_guessed = self.letters_guessed,                                                                        
-                                    attempts_remaining = self.attempts_remaining,
-                                    game_over = self.game_over,
-                                    message = message)
-
-    def end_game(self, won):
+        return GameForm(urlsafe_key=self.key.urlsafe(), message=message,
+                        **self.get_state(user_name))
+
+    def save_move(self, attempts_counted):
+        """Saves the game after a move. attempts_counted is the number of
+        attempts remaining of the game before the move, as counted in the
+        active games aggregate. Returns False if the game was cancelled or
+        ended meanwhile, in which case it is not saved."""
+        return self.save_move_async(attempts_counted).get_result()
+
+    @ndb.tasklet
+    def save_move_async(self, attempts_counted):
+        """Tasklet version of 'save_move'"""
+        shard_key = random_shard_key()
+
+        @ndb.tasklet
+        def txn():
+            # Read again so that a game cancelled meanwhile is not recreated
+            stored = yield self.key.get_async()
+            if not stored or stored.game_over:
+                raise ndb.Return(False)
+            entities = [self]
+            if self.attempts_remaining != attempts_counted:
+                shard = yield shard_key.get_async()
+                entities.append(apply_update(shard_key, shard,
+                                             self.attempts_remaining - attempts_counted))
+            yield ndb.put_multi_async(entities)
+            raise ndb.Return(True)
+        saved = yield ndb.transaction_async(txn, xg=True)
+        if saved:
+            self.cache_state()
+        raise ndb.Return(saved)
+
+    def cancel(self):
+        """Deletes a game that is not over. Returns False if the game is over"""
+        return self.cancel_async().get_result()
+
+    @ndb.tasklet
+    def cancel_async(self):
+        """Tasklet version of 'cancel'"""
+        shard_key = random_shard_key()
+
+        @ndb.tasklet
+        def txn():
+            game, shard, user = yield ndb.get_multi_async([self.key, shard_key,
+                                                           self.user])
+            if not game or game.game_over:
+                raise ndb.Return(False)
+            entities = [apply_update(shard_key, shard, -game.attempts_remaining, -1)]
+            if user:
+                user.active_games = max(0, user.active_games - 1)
+                entities.append(user)
+            yield game.key.delete_async(), ndb.put_multi_async(entities)
+            raise ndb.Return(True)
+        cancelled = yield ndb.transaction_async(txn, xg=True)
+        if cancelled:
+            gamecache.delete_state(self.key.urlsafe())
+        raise ndb.Return(cancelled)
+
+    def end_game(self, won, attempts_counted=None):
         """Ends the game - if won is True, the player won. - if won is False,
-        the player lost."""
-        self.game_over = True
-        self.put()
-        # Add the game to the score board
-        score = Score(user=self.user, date=date.today(), won=won,
-                      guesses=self.attempts_allowed - self.attempts_remaining)
-        score.put()
-        # Update the winner
-        if won == True:
-            self.user.get().add_win()
-        elif won == False:
-            self.user.get().add_loss()
+        the player lost. attempts_counted is the number of attempts remaining
+        of the game in the active games aggregate, by default the current one.
+        The game, its score, the player and the aggregate are written together
+        in one transaction, then a win is added to the cached high score
+        board. Returns False if the game was already over or was
+        cancelled."""
+        return self.end_game_async(won, attempts_counted).get_result()
+
+    @ndb.tasklet
+    def end_game_async(self, won, attempts_counted=None):
+        """Tasklet version of 'end_game'"""
+        if attempts_counted is None:
+            attempts_counted = self.attempts_remaining
+        shard_key = random_shard_key()
+
+        @ndb.tasklet
+        def txn():
+            stored, user, shard = yield ndb.get_multi_async([self.key, self.user,
+                                                             shard_key])
+            if not stored or stored.game_over:
+                # Already ended, or deleted by cancel_game meanwhile
+                raise ndb.Return(None)
+            self.game_over = True
+            self.won = won
+            self.ended = datetime.datetime.utcnow()
+            if not self.user_name and user:
+                # Created before the user name was copied onto the games
+                self.user_name = user.name
+            # Add the game to the score board
+            score = Score(user=self.user, user_name=self.user_name,
+                          date=date.today(), won=won,
+                          guesses=self.attempts_allowed - self.attempts_remaining)
+            entities = [self, score,
+                        apply_update(shard_key, shard, -attempts_counted, -1)]
+            # Update the winner
+            if user:
+                user.record_result(won)
+                entities.append(user)
+            yield ndb.put_multi_async(entities)
+            raise ndb.Return(score)
+        score = yield ndb.transaction_async(txn, xg=True)
+        if score:
+            self.cache_state()
+        if score and won:
+            record_win(score.guesses, score.date, score.user_name or '')
+        raise ndb.Return(score is not None)
+
+class ArchivedGame(ndb.Model):
+    """Summary of a finished Game, kept once the Game is deleted. It has the
+    id of the Game"""
+    user = ndb.KeyProperty(required=True, kind='User')
+    user_name = ndb.StringProperty(indexed=False)
+    word = ndb.StringProperty(required=True, indexed=False)
+    won = ndb.BooleanProperty(required=True, indexed=False)
+    moves = ndb.IntegerProperty(default=0, indexed=False)
+    attempts_allowed = ndb.IntegerProperty(indexed=False)
+    attempts_remaining = ndb.IntegerProperty(indexed=False)
+    ended = ndb.DateTimeProperty()
+
+    @classmethod
+    def from_game(cls, game):
+        """Returns the unsaved summary of a finished Game"""
+        return cls(id=game.key.id(), user=game.user, user_name=game.user_name,
+                   word=game.word_to_guess, won=game.is_won(),
+                   moves=len(game.get_moves()),
+                   attempts_allowed=game.attempts_allowed,
+                   attempts_remaining=game.attempts_remaining,
+                   ended=game.ended)
 
 class GameForm(messages.Message):
     """Game form for game state information"""
@@ -70,7 +358,20 @@ class GameForm(messages.Message):
     message = messages.StringField(4, required=True)
     user_name = messages.StringField(5, required=True)
     letters_guessed = messages.StringField(6, required=True)
+    # Version of the game state, sent back to 'get_game' when polling
+    version = messages.IntegerField(7)
+    not_modified = messages.BooleanField(8, default=False)
+
+class MoveForm(messages.Message):
+    """Move form for a single guess and its result"""
+    guess = messages.StringField(1, required=True)
+    result = messages.StringField(2, required=True)
+
+class GameHistoryForm(messages.Message):
+    """Return the moves of a game in order"""
+    items = messages.MessageField(MoveForm, 1, repeated=True)
 
 class GameForms(messages.Message):
     """Return multiple game forms"""
     items = messages.MessageField(GameForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
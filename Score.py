@@ -4,6 +4,7 @@ from datetime import date
 from protorpc import messages
 from google.appengine.ext import ndb
 from User import User
+from utils import get_user_names
 
 class Score(ndb.Model):
     """Score object"""
@@ -11,11 +12,24 @@ class Score(ndb.Model):
     date = ndb.DateProperty(required=True)
     won = ndb.BooleanProperty(required=True)
     guesses = ndb.IntegerProperty(required=True)
+    # Copy of the user name so that forms can be built without fetching the user
+    user_name = ndb.StringProperty(indexed=False)
     
-    def to_score_form(self):
-        return ScoreForm(user_name=self.user.get().name, won=self.won,
+    def to_score_form(self, user_name=None):
+        if user_name is None:
+            user_name = self.user_name or self.user.get().name
+        return ScoreForm(user_name=user_name, won=self.won,
                          date=str(self.date), guesses=self.guesses)
 
+    @classmethod
+    def to_score_forms(cls, scores, next_cursor=None):
+        """Returns a ScoreForms of the scores, fetching the users in one batch"""
+        scores = list(scores)
+        names = get_user_names(scores)
+        return ScoreForms(items=[score.to_score_form(names.get(score.user, ''))
+                                 for score in scores],
+                          next_cursor=next_cursor)
+
 class ScoreForm(messages.Message):
     """ScoreForm for outbound Score information"""
     user_name = messages.StringField(1, required=True)
@@ -26,4 +40,5 @@ class ScoreForm(messages.Message):
 class ScoreForms(messages.Message):
     """Return multiple ScoreForms"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
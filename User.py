@@ -1,7 +1,31 @@
-"""User.py - This file contains the class definitions for User, UserForm and UserForms."""
+"""User.py - This file contains the class definitions for User, UserName, UserForm and
+UserForms. Users are looked up by name through the UserName entity keyed by the normalized
+name, so a lookup is a key get served by the ndb caches, and through an in-process cache."""
 
+import collections
 from protorpc import messages
 from google.appengine.ext import ndb
+from cache import LRUCache
+from utils import chunks
+
+# Users recently looked up by name on this instance
+USER_CACHE_SIZE = 1000
+USER_CACHE_TTL = 60
+_user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+# Number of entities written by each put_multi of the bulk methods
+BULK_CHUNK_SIZE = 200
+
+
+def normalize_name(name):
+    """Returns the name used to look up a user: two names differing only by
+    case or surrounding spaces belong to the same user"""
+    return name.strip().lower()
+
+
+class UserName(ndb.Model):
+    """Maps a normalized user name, the id of the entity, to the User key"""
+    user = ndb.KeyProperty(required=True, kind='User')
+
 
 class User(ndb.Model):
     """User profile"""
@@ -9,30 +33,164 @@ class User(ndb.Model):
     email = ndb.StringProperty()
     wins = ndb.IntegerProperty(default=0)
     total_games_played = ndb.IntegerProperty(default=0)
+    # Number of games of the player that are not over, for the reminder emails
+    active_games = ndb.IntegerProperty(default=0)
 
-    """Adding an auto calculated field"""
-    @property
-    def win_percentage(self):
+    def _win_percentage(self):
         if self.total_games_played >0:
             return float(self.wins)/float(self.total_games_played)
         else:
-            return 0
-    def to_user_form(self):
+            return 0.0
+
+    """Adding auto calculated fields, stored and indexed so that the rankings
+    can be read in order"""
+    win_percentage = ndb.ComputedProperty(_win_percentage)
+    ranked = ndb.ComputedProperty(lambda self: self.total_games_played > 0)
+
+    @classmethod
+    def get_by_name(cls, name):
+        """Returns the User with the given name or None"""
+        return cls.get_by_name_async(name).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def get_by_name_async(cls, name):
+        """Tasklet version of 'get_by_name'"""
+        if not name or not name.strip():
+            raise ndb.Return(None)
+        normalized = normalize_name(name)
+        user = _user_cache.get(normalized)
+        if user is None:
+            mapping = yield ndb.Key(UserName, normalized).get_async()
+            if mapping:
+                user = yield mapping.user.get_async()
+            else:
+                user = yield cls._get_unmapped_async(name)
+            if user:
+                _user_cache.set(normalized, user)
+        raise ndb.Return(user)
+
+    @classmethod
+    @ndb.tasklet
+    def _get_unmapped_async(cls, name):
+        """Returns the User named 'name' created before the UserName mappings
+        existed, creating its mapping, or None. Only names without a mapping
+        pay for this query, so users are migrated as they are looked up even
+        if /tasks/backfill has not been run"""
+        user = yield cls.query(cls.name == name).get_async()
+        if user:
+            yield UserName.get_or_insert_async(normalize_name(name), user=user.key)
+        raise ndb.Return(user)
+
+    def create(self):
+        """Saves a new User together with its name mapping. Returns False if
+        a User with the same normalized name already exists"""
+        mapping_key = ndb.Key(UserName, normalize_name(self.name))
+        if not mapping_key.get() and self._get_unmapped_async(self.name).get_result():
+            # A user created before the mappings existed, now mapped
+            return False
+
+        def txn():
+            if mapping_key.get():
+                return False
+            self.put()
+            UserName(key=mapping_key, user=self.key).put()
+            return True
+        return ndb.transaction(txn, xg=True)
+
+    @classmethod
+    def get_by_names(cls, names):
+        """Returns a dict of normalized name to User for the names that
+        exist. The users not cached are fetched with two batch gets, and the
+        names without a mapping are queried concurrently"""
+        found = {}
+        missing = []
+        originals = {}
+        for name in names:
+            if name and name.strip():
+                originals.setdefault(normalize_name(name), name)
+        for normalized in originals:
+            user = _user_cache.get(normalized)
+            if user is None:
+                missing.append(normalized)
+            else:
+                found[normalized] = user
+        mappings = ndb.get_multi([ndb.Key(UserName, name) for name in missing])
+        pairs = [(name, mapping.user) for name, mapping in zip(missing, mappings)
+                 if mapping]
+        users = ndb.get_multi([key for _, key in pairs])
+        # Users created before the mappings existed, queried concurrently
+        unmapped = [(name, cls._get_unmapped_async(originals[name]))
+                    for name, mapping in zip(missing, mappings) if not mapping]
+        users_found = zip([name for name, _ in pairs], users) + \
+            [(name, future.get_result()) for name, future in unmapped]
+        for name, user in users_found:
+            if user:
+                found[name] = user
+                _user_cache.set(name, user)
+        return found
+
+    @classmethod
+    def create_users(cls, users):
+        """Saves new Users with their name mappings, BULK_CHUNK_SIZE at a time
+        with one put_multi each. The Users whose normalized name is taken or
+        repeated in the list are skipped. Unlike 'create' this is not
+        transactional, so a concurrent 'create' of the same name can win
+        the race. Returns the list of the Users created"""
+        unique = collections.OrderedDict()
+        for user in users:
+            unique.setdefault(normalize_name(user.name), user)
+        existing = cls.get_by_names([user.name for user in unique.values()])
+        created = [user for name, user in unique.items() if name not in existing]
+        for chunk in chunks(created, BULK_CHUNK_SIZE):
+            # Allocating the ids first lets the mappings go in the same batch
+            first, _ = cls.allocate_ids(len(chunk))
+            entities = []
+            for i, user in enumerate(chunk):
+                user.key = ndb.Key(cls, first + i)
+                entities.append(user)
+                entities.append(UserName(id=normalize_name(user.name), user=user.key))
+            ndb.put_multi(entities)
+        return created
+
+    @classmethod
+    def rankings_query(cls):
+        """Returns the query of the players that have played, best first"""
+        return cls.query(cls.ranked == True).order(-cls.win_percentage, -cls.wins)
+
+    def get_rank(self):
+        """Returns the rank of the player, 1 for the best win ratio. Players
+        with the same win ratio share the same rank"""
+        if not self.ranked:
+            return None
+        better = User.query(User.ranked == True,
+                            User.win_percentage > self.win_percentage)
+        return better.count(keys_only=True) + 1
+
+    def to_user_form(self, rank=None):
         """Copy user information to form"""
         return UserForm(name=self.name,
                         email=self.email,
                         wins=self.wins,
                         total_games_played=self.total_games_played,
-                        win_percentage=self.win_percentage)
+                        win_percentage=self.win_percentage,
+                        rank=rank)
+    def record_result(self, won):
+        """records the result of a game to the player without saving it"""
+        _user_cache.delete(normalize_name(self.name))
+        if won:
+            self.wins += 1
+        self.total_games_played +=1
+        self.active_games = max(0, self.active_games - 1)
+
     def add_win(self):
         """records the victory to the player"""
-        self.wins += 1
-        self.total_games_played +=1
+        self.record_result(True)
         self.put()
 
     def add_loss(self):
         """ records a loss to the player"""
-        self.total_games_played +=1
+        self.record_result(False)
         self.put()
 
 class UserForm(messages.Message):
@@ -42,7 +200,9 @@ class UserForm(messages.Message):
     wins = messages.IntegerField(3, required=True)
     total_games_played = messages.IntegerField(4, required=True)
     win_percentage = messages.FloatField(5, required=True)
+    rank = messages.IntegerField(6)
 
 class UserForms(messages.Message):
     """Return multiple User Forms """
     items = messages.MessageField(UserForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
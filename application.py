@@ -1,27 +1,43 @@
 """application.py - Create and configure the Game API exposing the resources.
-This file contains game logic including 'create_user', 'new_game', 'make_move',
-'get_game', 'get_game_history', 'cancel_game', 'get_scores', 'get_high_scores',
-'get_user_games', 'get_average_attempts', '_cache_average_attempts'.
+This file contains game logic including 'create_user', 'create_users', 'new_game',
+'new_games', 'make_move', 'make_moves', 'get_hint', 'auto_play', 'get_game',
+'get_game_history', 'cancel_game', 'get_scores', 'get_high_scores', 'get_user_games',
+'get_user_rankings', 'get_user_rank', 'get_average_attempts', 'get_stats',
+'_reconcile_average_attempts'. Every method is wrapped by the
+'instrumented' decorator of instrumentation.py.
 """
 
 
 import endpoints
 from protorpc import remote, messages
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
 from models import *
-from utils import get_by_urlsafe
+from utils import get_by_urlsafe, fetch_page
+from instrumentation import instrumented, get_stats
+from counters import get_active_games, reset_active_games
+import engine
+import highscores
+import gamecache
+from history import describe_outcome
+from solver import get_solver
 import re
 from settings import *
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
+EMAIL_PATTERN = '^[_a-z0-9-]+(\.[_a-z0-9-]+)*@[a-z0-9-]+(\.[a-z0-9-]+)*(\.[a-z]{2,4})$'
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(urlsafe_game_key=messages.StringField(1),)
+POLL_GAME_REQUEST = endpoints.ResourceContainer(urlsafe_game_key=messages.StringField(1),
+                                                version=messages.IntegerField(2),)
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(MakeMoveForm, urlsafe_game_key=messages.StringField(1),)
+MAKE_MOVES_REQUEST = endpoints.ResourceContainer(MakeMovesForm, urlsafe_game_key=messages.StringField(1),)
 USER_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1), email=messages.StringField(2))
+PAGE_REQUEST = endpoints.ResourceContainer(page_size=messages.IntegerField(1),
+                                          cursor=messages.StringField(2))
+USER_PAGE_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1),
+                                               page_size=messages.IntegerField(2),
+                                               cursor=messages.StringField(3))
 GET_HIGH_SCORES_REQUEST = endpoints.ResourceContainer(results= messages.IntegerField(1))
-MEMCACHE_MOVES_REMAINING = 'MOVES_REMAINING'
 
 @endpoints.api(name='hangman', version='v1', audiences=[ANDROID_AUDIENCE],
     allowed_client_ids=[WEB_CLIENT_ID, API_EXPLORER_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID],
@@ -34,17 +50,19 @@ class HangmanApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @instrumented
     def create_user(self, request):
         """Create a User which requires a unique username"""
-        if User.query(User.name == request.user_name).get():
-            raise endpoints.ConflictException('A User with that name already exists!')
+        if not request.user_name or not request.user_name.strip():
+            raise endpoints.BadRequestException('Invalid user name')
         """ Import function from regex used to check email validity"""
-        user = User(name=request.user_name)
+        user = User(name=request.user_name, email=request.email)
         if request.email:
-            match = re.match('^[_a-z0-9-]+(\.[_a-z0-9-]+)*@[a-z0-9-]+(\.[a-z0-9-]+)*(\.[a-z]{2,4})$',request.email)
+            match = re.match(EMAIL_PATTERN,request.email)
             if match == None:
-                raise ValueError('Bad Syntax')
-        user.put()
+                raise endpoints.BadRequestException('Bad Syntax')
+        if not user.create():
+            raise endpoints.ConflictException('A User with that name already exists!')
         return StringMessage(message='User {} created!'.format(request.user_name))
 
     @endpoints.method(request_message=NEW_GAME_REQUEST,
@@ -52,196 +70,380 @@ class HangmanApi(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @instrumented
     def new_game(self, request):
         """Creates a new game"""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A user with that name does not exist!')
         try:
-            game = Game.new_game(user.key,9)
-        except ValueError:
-            raise endpoints.BadRequestException('error message')
-
-        # Use a task queue to update the average attempts remaining.
-        # This operation is not needed to complete the creation of a new game
-        # so it is performed out of sequence.
-        taskqueue.add(url='/tasks/cache_average_attempts')
-        game.letters_right_position = ''
-        for i in range(len(game.word_to_guess)):
-            game.letters_right_position += '_ '
+            game = Game.new_game(user, 9, request.min_length,
+                                 request.max_length, request.difficulty)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
         return game.to_game_form('Good luck playing Hangman!'+game.letters_right_position)
     
+    @endpoints.method(request_message=NewUsersForm,
+                      response_message=NewUsersResultForm,
+                      path='users',
+                      name='create_users',
+                      http_method='POST')
+    @instrumented
+    def create_users(self, request):
+        """Create several Users at once. The names already taken, repeated
+        or invalid are reported instead of raising an error"""
+        result = NewUsersResultForm()
+        users = []
+        for form in request.users:
+            if not form.user_name.strip() or \
+                    (form.email and not re.match(EMAIL_PATTERN, form.email)):
+                result.invalid.append(form.user_name)
+            else:
+                users.append(User(name=form.user_name, email=form.email))
+        created = User.create_users(users)
+        result.created = [user.name for user in created]
+        # Only the Users created are given a key, a repeated name is skipped
+        result.existing = [user.name for user in users if user.key is None]
+        return result
+
+    @endpoints.method(request_message=NewGamesForm,
+                      response_message=NewGamesResultForm,
+                      path='games',
+                      name='new_games',
+                      http_method='POST')
+    @instrumented
+    def new_games(self, request):
+        """Creates one game for each user name of the list, in order. The
+        unknown user names are reported instead of raising an error"""
+        users = User.get_by_names(request.user_names)
+        players = []
+        missing = []
+        for name in request.user_names:
+            user = users.get(normalize_name(name)) if name and name.strip() else None
+            if user:
+                players.append(user)
+            else:
+                missing.append(name)
+        try:
+            games = Game.new_games(players, 9, request.min_length,
+                                   request.max_length, request.difficulty)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        return NewGamesResultForm(urlsafe_keys=[game.key.urlsafe() for game in games],
+                                  missing_users=missing)
+
     @endpoints.method(request_message=MAKE_MOVE_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @instrumented
     def make_move(self, request):
         """Makes a move. Returns a game state with message"""
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
         if game.game_over:
-            return game.to_form('Game already over!')
-        """Check validity of the guess"""
-        if not request.guess.isalpha():
-            raise endpoints.BadRequestException('Invalid guess!')
-        if len(request.guess)!=len(game.word_to_guess) and len(request.guess)!=1 :
+            return game.to_game_form('Game already over!')
+        """Check validity of the guess and apply it"""
+        attempts = game.attempts_remaining
+        outcome = game.make_guess(request.guess)
+        if outcome == engine.INVALID:
             raise endpoints.BadRequestException('Invalid guess!')
-        """Try to Guess the whole word"""
-        if len(request.guess)==len(game.word_to_guess):
-            if request.guess == game.word_to_guess:
-                game.history.append(request.guess+" is the correct word")
-                game.end_game(True)
-                return game.to_game_form('You won!')
-            else:
-                game.history.append(request.guess+ "is the wrong word")
-                game.attempts_remaining -= 1
-            """Guess the word letter by letter"""
+        if outcome == engine.REPEATED:
+            raise endpoints.BadRequestException('Repeated letter!')
+        return self._save_moves(game, attempts)
+
+    @endpoints.method(request_message=MAKE_MOVES_REQUEST,
+                      response_message=MovesForm,
+                      path='game/{urlsafe_game_key}/moves',
+                      name='make_moves',
+                      http_method='PUT')
+    @instrumented
+    def make_moves(self, request):
+        """Makes several moves in order, stopping when the game is over. The
+        game is saved once. Returns the result of every move applied and the
+        game state with message"""
+        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if game.game_over:
+            return MovesForm(game=game.to_game_form('Game already over!'))
+        attempts = game.attempts_remaining
+        moves = []
+        changed = False
+        for guess in request.guesses:
+            outcome = game.make_guess(guess)
+            moves.append(MoveForm(guess=guess, result=describe_outcome(outcome)))
+            changed = changed or outcome not in (engine.INVALID, engine.REPEATED)
+            if game.word_found or game.attempts_remaining == 0:
+                break
+        if changed:
+            form = self._save_moves(game, attempts)
         else:
-            if request.guess in game.letters_guessed:
-                raise endpoints.BadRequestException('Repeated letter!')
-            game.letters_guessed += request.guess
-            """Check the letter is in the correct letter or not"""
-            if request.guess in game.word_to_guess:
-                failed = 0;
-                game.letters_right_position = '';
-                for char in game.word_to_guess:
-                    if char in game.letters_guessed:
-                        game.letters_right_position += char
-                    else:
-                        game.letters_right_position += '_ '
-                        failed += 1
-                game.history.append(request.guess+" found")
-                if failed == 0:
-                    game.end_game(True)
-                    return game.to_game_form('You won!')
-            else:
-                game.attempts_remaining -= 1
-                game.history.append(request.guess+" is not in word")
-        
+            # Only invalid or repeated guesses, nothing to save
+            form = game.to_game_form("The letters you already got are "+game.letters_right_position)
+        return MovesForm(moves=moves, game=form)
+
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=HintForm,
+                      path='game/{urlsafe_game_key}/hint',
+                      name='get_hint',
+                      http_method='GET')
+    @instrumented
+    def get_hint(self, request):
+        """Returns the next guess suggested by the solver, computed from the
+        letters guessed and their positions only"""
+        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if game.game_over:
+            raise endpoints.BadRequestException('Game already over!')
+        words_guessed = set(guess for guess, _ in game.get_moves()
+                            if len(guess) > 1)
+        guess, candidates = get_solver().hint(game.word_to_guess,
+                                              game.letters_guessed,
+                                              words_guessed)
+        return HintForm(guess=guess, candidates=candidates)
+
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=MovesForm,
+                      path='game/{urlsafe_game_key}/auto',
+                      name='auto_play',
+                      http_method='PUT')
+    @instrumented
+    def auto_play(self, request):
+        """Plays the game to the end with the guesses of the solver. The
+        game is saved once. Returns the result of every move and the game
+        state with message"""
+        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if game.game_over:
+            return MovesForm(game=game.to_game_form('Game already over!'))
+        attempts = game.attempts_remaining
+        player = get_solver()
+        moves = []
+        words_guessed = set(guess for guess, _ in game.get_moves()
+                            if len(guess) > 1)
+        while not game.word_found and game.attempts_remaining > 0:
+            guess, _ = player.hint(game.word_to_guess, game.letters_guessed,
+                                   words_guessed)
+            if guess is None:
+                break
+            if len(guess) > 1:
+                words_guessed.add(guess)
+            outcome = game.make_guess(guess)
+            if outcome in (engine.INVALID, engine.REPEATED):
+                # The state did not change, the same hint would be repeated
+                break
+            moves.append(MoveForm(guess=guess, result=describe_outcome(outcome)))
+        return MovesForm(moves=moves, game=self._save_moves(game, attempts))
+
+    @staticmethod
+    def _save_moves(game, attempts):
+        """Saves a game after one or more moves, ending it if it is over.
+        attempts is the number of attempts remaining before the moves.
+        Returns the game state with message"""
+        if game.word_found:
+            if not game.end_game(True, attempts):
+                raise endpoints.NotFoundException('Game not found!')
+            return game.to_game_form('You won!')
+
         """Check it's the end of game or not"""
         if game.attempts_remaining ==0:
-            game.end_game(False)
+            if not game.end_game(False, attempts):
+                raise endpoints.NotFoundException('Game not found!')
             return game.to_game_form('Letters you already got are '+game.letters_right_position + ' But game is over!')
-        else:
-            game.put()
+        elif not game.save_move(attempts):
+            # Cancelled or ended by another request meanwhile
+            raise endpoints.NotFoundException('Game not found!')
         return game. to_game_form("The letters you already got are "+game.letters_right_position)
 
-    @endpoints.method(request_message=GET_GAME_REQUEST,
+    @endpoints.method(request_message=POLL_GAME_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @instrumented
     def get_game(self, request):
-        """Return the current state of a given name."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game:
-            return game.to_game_form('Here is the requested game')
-        else:
-            raise endpoints.NotFoundException('Game not found!')
+        """Return the current state of a given name. The state is served
+        from memcache when cached; not_modified is set if it is the version
+        sent by the client"""
+        state = gamecache.get_state(request.urlsafe_game_key)
+        if state is None:
+            game = get_by_urlsafe(request.urlsafe_game_key, Game)
+            if not game:
+                raise endpoints.NotFoundException('Game not found!')
+            state = game.cache_state()
+        if request.version is not None and request.version == state['version']:
+            return GameForm(urlsafe_key=request.urlsafe_game_key,
+                            message='Not modified', not_modified=True, **state)
+        return GameForm(urlsafe_key=request.urlsafe_game_key,
+                        message='Here is the requested game', **state)
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
-                      response_message=StringMessage,
+                      response_message=GameHistoryForm,
                       path='game/{urlsafe_game_key}/history',
                       name='get_game_history',
                       http_method='GET')
+    @instrumented
     def get_game_history(self, request):
         """Returns a given game's history, namely all the moves"""
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
         if not game:
           raise endpoints.NotFoundException('Game not found!')
-        return StringMessage(message=str(game.history))
+        return game.to_history_form()
      
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=StringMessage,
                       path='game/{urlsafe_game_key}',
                       name='cancel_game',
                       http_method='DELETE')
+    @instrumented
     def cancel_game(self, request):
       """ Remove and kill game that has not ended"""
       game=get_by_urlsafe(request.urlsafe_game_key, Game)
-      if game and not game.game_over:
-        game.key.delete()
+      if game and not game.game_over and game.cancel():
         return StringMessage(message='Game id key:{} removed'.
         format(request.urlsafe_game_key))
-      elif game and game.game_over:
+      elif game:
         raise endpoints.BadRequestException('Sorry! Completed games can not be deleted')
       else:
         raise endpoints.NotFoundException('No such game found') 
 
-    @endpoints.method(response_message=ScoreForms,
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=ScoreForms,
                       path='scores',
                       name='get_scores',
                       http_method='GET')
+    @instrumented
     def get_scores(self, request):
-        """Return all scores in the scoreborad"""
-        return ScoreForms(items=[score.to_score_form() for score in Score.query()])
+        """Return one page of the scores in the scoreborad"""
+        scores, next_cursor = fetch_page(Score.query(), request.page_size, request.cursor)
+        return Score.to_score_forms(scores, next_cursor)
 
     @endpoints.method(request_message=GET_HIGH_SCORES_REQUEST,
                       response_message=ScoreForms,
                       path='high_scores',
                       name='get_high_scores',
                       http_method='GET')
+    @instrumented
     def get_high_scores(self, request):
         """Return the scores graded from highest to lowest"""
+        forms = highscores.get_high_scores(request.results)
+        if forms is not None:
+            return forms
         Scores =Score.query(Score.won == True).order(Score.guesses).fetch(request.results)
-        return ScoreForms(items=[score.to_score_form() for score in Scores])
+        return Score.to_score_forms(Scores)
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_PAGE_REQUEST,
                       response_message=GameForms,
                       path='user/games',
                       name='get_user_games',
                       http_method='GET')
+    @instrumented
     def get_user_games(self, request):
-        """Return all the games of a given user"""
-        user = User.query(User.name == request.user_name).get()
+        """Return one page of the active games of a given user"""
+        user = User.get_by_name(request.user_name)
         if not user:
           raise endpoints.NotFoundException('User not found')
         games = Game.query(Game.user == user.key).filter(Game.game_over == False)
-        return GameForms(items=[game.to_game_form("active game") for game in games])
+        games, next_cursor = fetch_page(games, request.page_size, request.cursor)
+        return GameForms(items=[game.to_game_form("active game", user.name)
+                                for game in games],
+                         next_cursor=next_cursor)
 
-    @endpoints.method(response_message=UserForms,
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=UserForms,
                       path='user/rankings',
                       name='get_user_rankings',
                       http_method='GET')
+    @instrumented
     def get_user_rankings(self, request):
-        """Return graded user user_rankings based on win ratios"""
-        users =User.query(User.total_games_played > 0).fetch()
-        users = sorted(users, key=lambda x: x.win_percentage, reverse=True)
-        return UserForms(items=[user.to_user_form() for user in users])
+        """Return one page of the users graded by win ratio"""
+        users, next_cursor = fetch_page(User.rankings_query(), request.page_size,
+                                        request.cursor)
+        return UserForms(items=[user.to_user_form() for user in users],
+                         next_cursor=next_cursor)
 
     @endpoints.method(request_message=USER_REQUEST,
+                      response_message=UserForm,
+                      path='user/{user_name}/rank',
+                      name='get_user_rank',
+                      http_method='GET')
+    @instrumented
+    def get_user_rank(self, request):
+        """Return a user with their rank by win ratio"""
+        user = User.get_by_name(request.user_name)
+        if not user:
+            raise endpoints.NotFoundException('User not found')
+        return user.to_user_form(rank=user.get_rank())
+
+    @endpoints.method(request_message=USER_PAGE_REQUEST,
                       response_message=ScoreForms,
                       path='scores/user/{user_name}',
                       name='get_user_scores',
                       http_method='GET')
+    @instrumented
     def get_user_scores(self, request):
-        """Returns all of an individual User's scores"""
-        user = User.query(User.name == request.user_name).get()
+        """Returns one page of an individual User's scores"""
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
         scores = Score.query(Score.user == user.key)
-        return ScoreForms(items=[score.to_score_form() for score in scores])
+        scores, next_cursor = fetch_page(scores, request.page_size, request.cursor)
+        return ScoreForms(items=[score.to_score_form(user.name) for score in scores],
+                          next_cursor=next_cursor)
 
     @endpoints.method(response_message=StringMessage,
                       path='games/average_attempts',
                       name='get_average_attempts_remaining',
                       http_method='GET')
+    @instrumented
     def get_average_attempts(self, request):
-        """Get the cached average moves remaining"""
-        return StringMessage(message=memcache.get(MEMCACHE_MOVES_REMAINING) or '')
+        """Get the average moves remaining from the sharded aggregate"""
+        total_attempts_remaining, count = get_active_games()
+        if count <= 0:
+            return StringMessage(message='')
+        average = float(total_attempts_remaining)/count
+        return StringMessage(message='The average moves remaining is {:.2f}'.format(average))
+
+    @endpoints.method(response_message=StatsForms,
+                      path='stats',
+                      name='get_stats',
+                      http_method='GET')
+    def get_stats(self, request):
+        """Get the RPC and latency counters aggregated per method over the
+        sampled calls"""
+        items = []
+        for name, stats in sorted(get_stats().items()):
+            calls = stats['calls']
+            items.append(MethodStatsForm(
+                method=name, calls=calls,
+                average_ms=stats['wall_us'] / 1000.0 / calls if calls else 0.0,
+                datastore_get=stats['datastore_get'],
+                datastore_put=stats['datastore_put'],
+                datastore_query=stats['datastore_query'],
+                datastore_delete=stats['datastore_delete'],
+                memcache_hit=stats['memcache_hit'],
+                memcache_miss=stats['memcache_miss'],
+                bytes_read=stats['bytes_read'],
+                bytes_written=stats['bytes_written']))
+        return StatsForms(items=items)
 
     @staticmethod
-    def _cache_average_attempts():
-        """Populates memcache with the average moves remaining of Games"""
-        games = Game.query(Game.game_over == False).fetch()
-        if games:
-            count = len(games)
-            total_attempts_remaining = sum([game.attempts_remaining
-                                        for game in games])
-            average = float(total_attempts_remaining)/count
-            memcache.set(MEMCACHE_MOVES_REMAINING,
-                         'The average moves remaining is {:.2f}'.format(average))
+    def _reconcile_average_attempts():
+        """Recomputes the active games aggregate from the Games. The aggregate
+        is kept up to date by every move, so this only corrects drift"""
+        count = 0
+        total_attempts_remaining = 0
+        query = Game.query(Game.game_over == False)
+        for game in query.iter(projection=[Game.attempts_remaining], batch_size=500):
+            count += 1
+            total_attempts_remaining += game.attempts_remaining
+        reset_active_games(total_attempts_remaining, count)
 
 api = endpoints.api_server([HangmanApi])
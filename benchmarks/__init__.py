@@ -0,0 +1,2 @@
+"""benchmarks - Scripts measuring the hot paths of the Hangman API.
+Run them from the project root, e.g. 'python -m benchmarks.bench_engine'."""
@@ -0,0 +1,44 @@
+"""bench_endpoints.py - Plays complete games through the HangmanApi methods on
+the testbed stubs and reports the p50/p99 latency of every endpoint.
+Usage: python -m benchmarks.bench_endpoints [players]"""
+
+import random
+import string
+import sys
+
+from benchmarks.harness import Harness
+
+
+def main(players=200):
+    harness = Harness()
+    app = harness.application
+    rng = random.Random(1)
+    try:
+        for i in range(players):
+            name = 'player{}'.format(i)
+            harness.call('create_user', app.USER_REQUEST, user_name=name,
+                         email='{}@example.com'.format(name))
+            game = harness.call('new_game', app.NEW_GAME_REQUEST, user_name=name)
+            guesses = list(string.ascii_lowercase)
+            rng.shuffle(guesses)
+            for guess in guesses:
+                form = harness.call('make_move', app.MAKE_MOVE_REQUEST,
+                                    urlsafe_game_key=game.urlsafe_key, guess=guess)
+                if form.game_over:
+                    break
+            harness.call('get_game', app.POLL_GAME_REQUEST,
+                         urlsafe_game_key=game.urlsafe_key)
+            harness.call('get_user_games', app.USER_PAGE_REQUEST, user_name=name)
+            harness.call('get_user_scores', app.USER_PAGE_REQUEST, user_name=name)
+            harness.call('get_average_attempts')
+        for _ in range(players // 10 or 1):
+            harness.call('get_scores', app.PAGE_REQUEST)
+            harness.call('get_high_scores', app.GET_HIGH_SCORES_REQUEST, results=10)
+            harness.call('get_user_rankings', app.PAGE_REQUEST)
+        harness.report()
+    finally:
+        harness.close()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
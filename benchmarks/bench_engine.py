@@ -0,0 +1,105 @@
+"""bench_engine.py - Micro-benchmark of guess evaluation. Compares the string
+based evaluation formerly inlined in 'make_move', a HangmanEngine built for
+every move and the 'engine.guess_letter' fast path used by 'Game.make_guess'.
+The last two also keep the letters guessed and the rendered pattern that
+'Game' stores next to the masks, as 'make_guess' does. The legacy loop
+remains the fastest per move in CPython on short words: the engine is about
+keeping the state as masks without the datastore, not about speed.
+Usage: python -m benchmarks.bench_engine [games]"""
+
+import random
+import sys
+import time
+
+import engine
+
+WORDS = ["beautiful", "extraordinary", "spectacular", "mountain", "fabulous",
+         "wonderful"]
+
+
+def legacy_move(word, state, guess):
+    """The evaluation done by 'make_move' before the engine existed. Returns
+    the new state and whether the game is over"""
+    letters_guessed, right_position, attempts = state
+    if guess in letters_guessed:
+        return state, False
+    letters_guessed += guess
+    if guess in word:
+        failed = 0
+        right_position = ''
+        for char in word:
+            if char in letters_guessed:
+                right_position += char
+            else:
+                right_position += '_ '
+                failed += 1
+        if failed == 0:
+            return (letters_guessed, right_position, attempts), True
+    else:
+        attempts -= 1
+    return (letters_guessed, right_position, attempts), attempts == 0
+
+
+def object_move(word, state, guess):
+    """The evaluation 'Game.make_guess' did before the fast path: a
+    HangmanEngine rebuilt from the stored masks for every move"""
+    guessed, revealed, attempts, letters_guessed, right_position = state
+    game = engine.HangmanEngine(word, guessed, revealed, attempts)
+    outcome = game.guess(guess)
+    if outcome in (engine.HIT, engine.MISS):
+        letters_guessed += guess
+    if outcome == engine.HIT:
+        right_position = game.pattern()
+    return (game.guessed, game.revealed, game.attempts_remaining,
+            letters_guessed, right_position), game.over
+
+
+def engine_move(word, state, guess):
+    """The evaluation done by 'Game.make_guess' for a letter: the fast path
+    on the stored masks"""
+    guessed, revealed, attempts, letters_guessed, right_position = state
+    outcome, guessed, revealed = engine.guess_letter(word, guessed, revealed,
+                                                     guess)
+    if outcome == engine.HIT:
+        right_position = engine.render_pattern(word, revealed)
+        return (guessed, revealed, attempts, letters_guessed + guess,
+                right_position), revealed == (1 << len(word)) - 1
+    if outcome == engine.MISS:
+        return (guessed, revealed, attempts - 1, letters_guessed + guess,
+                right_position), attempts == 1
+    return state, False
+
+
+def run(move, new_state, games):
+    """Plays every game to the end and returns the number of moves per second"""
+    moves = 0
+    start = time.time()
+    for word, guesses in games:
+        state = new_state(word)
+        for guess in guesses:
+            state, over = move(word, state, guess)
+            moves += 1
+            if over:
+                break
+    return moves / (time.time() - start)
+
+
+def main(count=20000):
+    rng = random.Random(1)
+    games = []
+    for _ in range(count):
+        guesses = list(engine.ALPHABET)
+        rng.shuffle(guesses)
+        games.append((rng.choice(WORDS), guesses))
+    legacy = run(legacy_move, lambda word: ('', '', 9), games)
+    rebuilt = run(object_move, lambda word: (0, 0, 9, '', ''), games)
+    fast = run(engine_move, lambda word: (0, 0, 9, '', ''), games)
+    print('legacy make_move evaluation: {:>12,.0f} moves/sec'.format(legacy))
+    print('HangmanEngine per move     : {:>12,.0f} moves/sec'.format(rebuilt))
+    print('engine.guess_letter        : {:>12,.0f} moves/sec'.format(fast))
+    print('fast path vs engine        : {:>12.2f}x'.format(fast / rebuilt))
+    print('fast path vs legacy        : {:>12.2f}x'.format(fast / legacy))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
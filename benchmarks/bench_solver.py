@@ -0,0 +1,43 @@
+"""bench_solver.py - Benchmark of the solver behind 'get_hint' and 'auto_play'.
+Plays a game of every word of the library, or of a word list, with the
+solver's guesses: once while the decision trees are built and once more on
+the built trees. Reports the time per game and the share of games won.
+Usage: python -m benchmarks.bench_solver [words.txt] [attempts]"""
+
+import sys
+import time
+
+import solver
+from words import WordLibrary, get_library
+
+
+def run(player, words, attempts):
+    """Plays a game of every word and returns the seconds per game and the
+    number of games won"""
+    won = 0
+    start = time.time()
+    for word in words:
+        state, _ = player.play(word, attempts)
+        won += state.won
+    return (time.time() - start) / max(len(words), 1), won
+
+
+def main(path=None, attempts=9):
+    library = WordLibrary.load(path) if path else get_library()
+    words = []
+    for bucket in library.buckets:
+        words.extend(library.words(bucket))
+    player = solver.Solver(library)
+    start = time.time()
+    for length in set(len(word) for word in words):
+        player.table(length)
+    print('{} words, tables built in {:.1f} ms'.format(
+        len(words), (time.time() - start) * 1000))
+    for label in ('building the trees', 'built trees'):
+        per_game, won = run(player, words, int(attempts))
+        print('{:<20}: {:>9.1f} us/game, {:.1f}% won'.format(
+            label, per_game * 1000000, 100.0 * won / max(len(words), 1)))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,142 @@
+"""harness.py - Runs the Hangman API and the main.app handlers against the App
+Engine testbed stubs and records the latency and the datastore and memcache
+RPCs of every call. The App Engine SDK must be installed; set APPENGINE_SDK
+to its 'google_appengine' directory if it is not already on the path."""
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_sdk():
+    """Puts the App Engine SDK and the application on sys.path"""
+    sdk = os.environ.get('APPENGINE_SDK')
+    if sdk and sdk not in sys.path:
+        sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def percentile(values, p):
+    """Returns the p-th percentile of a list of values"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+class Harness(object):
+    """Testbed with the datastore, memcache and taskqueue stubs, an instance
+    of HangmanApi and the main.app handlers. Records the latency and the
+    datastore and memcache RPCs of every call"""
+
+    def __init__(self):
+        setup_sdk()
+        from google.appengine.api import apiproxy_stub_map
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import testbed
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_mail_stub()
+        self.testbed.init_urlfetch_stub()
+        self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        import application
+        import main
+        self.application = application
+        self.main = main
+        self.api = application.HangmanApi()
+        self.timings = {}
+        self.rpcs = {}
+        self.current = None
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'benchmark', self._count_rpc)
+
+    def close(self):
+        self.testbed.deactivate()
+
+    def _count_rpc(self, service, call, request, response):
+        if self.current is not None:
+            counts = self.rpcs.setdefault(self.current, {})
+            counts[service] = counts.get(service, 0) + 1
+
+    def _timed(self, name, function, *args, **kwargs):
+        from google.appengine.ext import ndb
+        # Every call is a separate request with an empty in-context cache
+        ndb.get_context().clear_cache()
+        self.current = name
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.timings.setdefault(name, []).append(time.time() - start)
+            self.current = None
+
+    def call(self, name, container=None, **fields):
+        """Calls the HangmanApi method 'name' with a request built from the
+        ResourceContainer and the fields, and records its latency"""
+        from protorpc import message_types
+        if container is None:
+            request = message_types.VoidMessage()
+        else:
+            request = container.combined_message_class(**fields)
+        return self._timed(name, getattr(self.api, name), request)
+
+    def call_handler(self, path, method='GET', params=None, headers=None):
+        """Calls a main.app handler and records its latency"""
+        import urllib
+        import webapp2
+        body = urllib.urlencode(params or {})
+        request = webapp2.Request.blank(path, method=method, headers=headers,
+                                        POST=body if method == 'POST' else None)
+        response = self._timed(path, request.get_response, self.main.app)
+        if response.status_int >= 400:
+            raise RuntimeError('{} {} returned {}'.format(method, path,
+                                                          response.status))
+        return response
+
+    def run_tasks(self):
+        """Runs the queued tasks, and the tasks they enqueue, through main.app.
+        Returns the number of tasks run"""
+        count = 0
+        while True:
+            tasks = self.taskqueue_stub.get_filtered_tasks()
+            if not tasks:
+                return count
+            for task in tasks:
+                self.taskqueue_stub.DeleteTask(task.queue_name, task.name)
+            for task in tasks:
+                headers = {'X-AppEngine-QueueName': task.queue_name,
+                           'Content-Type': 'application/x-www-form-urlencoded'}
+                request = task.extract_params() if task.method == 'POST' else {}
+                self.call_handler(task.url.split('?')[0], task.method, request,
+                                  headers)
+                count += 1
+
+    def report(self, elapsed=None, out=sys.stdout):
+        """Prints per endpoint the number of calls, the throughput, the
+        p50/p90/p99 latency and the datastore and memcache RPCs per call"""
+        out.write('{:<34} {:>7} {:>9} {:>8} {:>8} {:>8} {:>9} {:>9}\n'.format(
+            'endpoint', 'calls', 'calls/s', 'p50 ms', 'p90 ms', 'p99 ms',
+            'ds rpc', 'mc rpc'))
+        for name in sorted(self.timings):
+            values = self.timings[name]
+            counts = self.rpcs.get(name, {})
+            out.write('{:<34} {:>7} {:>9.0f} {:>8.2f} {:>8.2f} {:>8.2f} {:>9.2f} {:>9.2f}\n'.format(
+                name, len(values), len(values) / (sum(values) or 1),
+                percentile(values, 50) * 1000, percentile(values, 90) * 1000,
+                percentile(values, 99) * 1000,
+                counts.get('datastore_v3', 0) / float(len(values)),
+                counts.get('memcache', 0) / float(len(values))))
+        if elapsed:
+            calls = sum(len(values) for values in self.timings.values())
+            out.write('{} calls in {:.1f}s, {:.0f} calls/s overall\n'.format(
+                calls, elapsed, calls / elapsed))
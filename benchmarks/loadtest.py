@@ -0,0 +1,73 @@
+"""loadtest.py - Simulates many concurrent players against the testbed stubs.
+Every player is a session that creates a user, plays full games through
+'make_move', polls them with 'get_game' and looks at the boards
+('get_high_scores', 'get_user_rankings').
+The sessions are interleaved in random order, one call at a time, so the
+datastore sees the requests of thousands of players mixed together as it
+would under concurrent load. The cron and task handlers of main.app are run
+at the end. Reports the throughput, the latency percentiles and the
+datastore and memcache RPCs per endpoint.
+Usage: python -m benchmarks.loadtest [players] [games_per_player]"""
+
+import random
+import string
+import sys
+import time
+
+from benchmarks.harness import Harness
+
+
+def player_session(harness, rng, number, games):
+    """Generator making the calls of one player, one call per step"""
+    app = harness.application
+    name = 'player{}'.format(number)
+    harness.call('create_user', app.USER_REQUEST, user_name=name,
+                 email='{}@example.com'.format(name))
+    yield
+    for _ in range(games):
+        game = harness.call('new_game', app.NEW_GAME_REQUEST, user_name=name)
+        yield
+        guesses = list(string.ascii_lowercase)
+        rng.shuffle(guesses)
+        for guess in guesses:
+            form = harness.call('make_move', app.MAKE_MOVE_REQUEST,
+                                urlsafe_game_key=game.urlsafe_key, guess=guess)
+            yield
+            if form.game_over:
+                break
+            # The client polls the game it is already up to date with
+            harness.call('get_game', app.POLL_GAME_REQUEST,
+                         urlsafe_game_key=game.urlsafe_key, version=form.version)
+            yield
+        harness.call('get_high_scores', app.GET_HIGH_SCORES_REQUEST, results=10)
+        yield
+        harness.call('get_user_rankings', app.PAGE_REQUEST)
+        yield
+    harness.call('get_user_scores', app.USER_PAGE_REQUEST, user_name=name)
+    yield
+    harness.call('get_average_attempts')
+
+
+def main(players=1000, games=2):
+    harness = Harness()
+    rng = random.Random(1)
+    sessions = [player_session(harness, rng, i, games) for i in range(players)]
+    start = time.time()
+    try:
+        while sessions:
+            i = rng.randrange(len(sessions))
+            try:
+                next(sessions[i])
+            except StopIteration:
+                sessions[i] = sessions[-1]
+                sessions.pop()
+        harness.call_handler('/crons/send_reminder')
+        harness.call_handler('/crons/reconcile_average_attempts')
+        harness.run_tasks()
+        harness.report(time.time() - start)
+    finally:
+        harness.close()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,43 @@
+"""cache.py - In-process LRU cache with a time to live. Each App Engine
+instance keeps its own copy, so the values must be safe to share between
+the threads of the instance and a short time to live bounds how stale they
+can be on the other instances."""
+
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """Thread-safe least recently used cache whose entries expire after ttl
+    seconds"""
+
+    def __init__(self, max_size=1000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value cached for the key or None"""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None or item[1] < time.time():
+                return None
+            self._items[key] = item
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, time.time() + self.ttl)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
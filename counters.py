@@ -0,0 +1,59 @@
+"""counters.py - Sharded aggregate of the active games: the number of games
+not over yet and the sum of their attempts remaining. Every update writes a
+single randomly chosen shard, so concurrent moves rarely contend, and the
+totals are read with one batch get of all the shards."""
+
+import random
+from google.appengine.ext import ndb
+
+NUM_SHARDS = 20
+
+
+class ActiveGamesShard(ndb.Model):
+    """One shard of the active games aggregate"""
+    attempts_remaining = ndb.IntegerProperty(default=0, indexed=False)
+    active_games = ndb.IntegerProperty(default=0, indexed=False)
+
+
+def _shard_key(i):
+    return ndb.Key(ActiveGamesShard, 'shard-{}'.format(i))
+
+
+def random_shard_key():
+    """Returns the key of a randomly chosen shard"""
+    return _shard_key(random.randint(0, NUM_SHARDS - 1))
+
+
+def apply_update(key, shard, attempts_delta, games_delta=0):
+    """Adds the deltas to a shard fetched by the caller (None if it does not
+    exist yet) and returns it without saving it"""
+    shard = shard or ActiveGamesShard(key=key)
+    shard.attempts_remaining += attempts_delta
+    shard.active_games += games_delta
+    return shard
+
+
+@ndb.transactional(propagation=ndb.TransactionOptions.ALLOWED)
+def update_active_games(attempts_delta, games_delta=0):
+    """Adds the deltas to one shard. Joins the current transaction if there
+    is one, so that the shard is written atomically with the game"""
+    key = random_shard_key()
+    apply_update(key, key.get(), attempts_delta, games_delta).put()
+
+
+def get_active_games():
+    """Returns the sum of the attempts remaining and the number of the
+    active games"""
+    shards = ndb.get_multi([_shard_key(i) for i in range(NUM_SHARDS)])
+    attempts_remaining = sum(shard.attempts_remaining for shard in shards if shard)
+    active_games = sum(shard.active_games for shard in shards if shard)
+    return attempts_remaining, active_games
+
+
+@ndb.transactional(xg=True)
+def reset_active_games(attempts_remaining, active_games):
+    """Overwrites the aggregate with totals recomputed from the games"""
+    shards = [ActiveGamesShard(key=_shard_key(i)) for i in range(NUM_SHARDS)]
+    shards[0].attempts_remaining = attempts_remaining
+    shards[0].active_games = active_games
+    ndb.put_multi(shards)
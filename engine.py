@@ -0,0 +1,158 @@
+"""engine.py - Pure-Python hangman engine used by 'Game' and 'make_move'.
+The engine has no datastore dependency. The letters guessed are kept as a
+26-bit mask (bit 0 is 'a') and the revealed positions of the word as a mask
+with one bit per character, using a cached letter -> positions index of the
+word. 'guess_letter' evaluates a letter guess on the masks stored by 'Game'
+without building a HangmanEngine."""
+
+ALPHABET = 'abcdefghijklmnopqrstuvwxyz'
+
+# Outcomes of a single guess
+INVALID = 0
+REPEATED = 1
+HIT = 2
+MISS = 3
+WORD_RIGHT = 4
+WORD_WRONG = 5
+
+# Number of word indexes and rendered patterns kept in memory before the
+# caches are reset
+INDEX_CACHE_SIZE = 4096
+PATTERN_CACHE_SIZE = 65536
+_index_cache = {}
+_pattern_cache = {}
+# Position in the alphabet of every valid single letter guess
+_letter_index = dict((char, i) for i, char in enumerate(ALPHABET))
+_letter_index.update((char.upper(), i) for i, char in enumerate(ALPHABET))
+
+
+def letter_bit(letter):
+    """Returns the bit of a lowercase letter in a 26-bit letter mask"""
+    return 1 << (ord(letter) - 97)
+
+
+def letters_to_mask(letters):
+    """Returns the 26-bit mask of the letters of a string"""
+    mask = 0
+    for char in letters.lower():
+        if 'a' <= char <= 'z':
+            mask |= letter_bit(char)
+    return mask
+
+
+def mask_to_letters(mask):
+    """Returns the letters of a 26-bit mask in alphabetical order"""
+    return ''.join(ALPHABET[i] for i in range(26) if mask >> i & 1)
+
+
+def word_index(word):
+    """Returns a tuple with, for every letter of the alphabet, the mask of
+    the positions where the letter appears in the word"""
+    index = _index_cache.get(word)
+    if index is None:
+        positions = [0] * 26
+        for i, char in enumerate(word):
+            positions[ord(char) - 97] |= 1 << i
+        index = tuple(positions)
+        if len(_index_cache) >= INDEX_CACHE_SIZE:
+            _index_cache.clear()
+        _index_cache[word] = index
+    return index
+
+
+def guess_letter(word, guessed, revealed, letter):
+    """Fast path of HangmanEngine.guess for a single letter that works on
+    the masks directly, without building an engine. Returns the outcome and
+    the new guessed and revealed masks. The attempts are left to the caller:
+    a MISS costs one"""
+    i = _letter_index.get(letter)
+    if i is None:
+        return INVALID, guessed, revealed
+    bit = 1 << i
+    if guessed & bit:
+        return REPEATED, guessed, revealed
+    if ALPHABET[i] not in word:
+        return MISS, guessed | bit, revealed
+    return HIT, guessed | bit, revealed | word_index(word)[i]
+
+
+def render_pattern(word, revealed):
+    """Returns the word with the letters at the positions not revealed
+    replaced by '_ '"""
+    key = (word, revealed)
+    pattern = _pattern_cache.get(key)
+    if pattern is None:
+        pattern = ''.join([char if revealed >> i & 1 else '_ '
+                           for i, char in enumerate(word)])
+        if len(_pattern_cache) >= PATTERN_CACHE_SIZE:
+            _pattern_cache.clear()
+        _pattern_cache[key] = pattern
+    return pattern
+
+
+def revealed_mask(word, guessed):
+    """Returns the revealed positions of the word for a letter mask"""
+    index = word_index(word)
+    mask = 0
+    for i in range(26):
+        if guessed >> i & 1:
+            mask |= index[i]
+    return mask
+
+
+class HangmanEngine(object):
+    """State of a single hangman game"""
+    __slots__ = ('word', 'index', 'full_mask', 'guessed', 'revealed',
+                 'attempts_remaining')
+
+    def __init__(self, word, guessed=0, revealed=0, attempts_remaining=9):
+        self.word = word
+        self.index = word_index(word)
+        self.full_mask = (1 << len(word)) - 1
+        self.guessed = guessed
+        self.revealed = revealed
+        self.attempts_remaining = attempts_remaining
+
+    @property
+    def won(self):
+        return self.revealed == self.full_mask
+
+    @property
+    def lost(self):
+        return self.attempts_remaining <= 0 and not self.won
+
+    @property
+    def over(self):
+        return self.attempts_remaining <= 0 or self.revealed == self.full_mask
+
+    def guess(self, guess):
+        """Applies a guess (a single letter or the whole word) and returns
+        one of the outcome constants of this module"""
+        if len(guess) == 1 and len(self.word) != 1:
+            i = _letter_index.get(guess)
+            if i is None:
+                return INVALID
+            bit = 1 << i
+            if self.guessed & bit:
+                return REPEATED
+            self.guessed |= bit
+            positions = self.index[i]
+            if positions:
+                self.revealed |= positions
+                return HIT
+            self.attempts_remaining -= 1
+            return MISS
+        guess = guess.lower()
+        # Only ASCII letters, isalpha() also accepts accented letters
+        if len(guess) != len(self.word) or \
+                not all(char in _letter_index for char in guess):
+            return INVALID
+        if guess == self.word:
+            self.revealed = self.full_mask
+            return WORD_RIGHT
+        self.attempts_remaining -= 1
+        return WORD_WRONG
+
+    def pattern(self):
+        """Returns the word with the letters not found yet replaced by '_ '"""
+        return render_pattern(self.word, self.revealed)
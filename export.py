@@ -0,0 +1,142 @@
+"""export.py - Export of the Score, Game, ArchivedGame and User entities for
+offline analytics. A task chain pages through each kind with cursors and
+stores every page as an ExportChunk: the rows of the page as gzipped CSV, one
+column per field of COLUMNS. The chunks of a kind are downloaded in parts of
+PART_CHUNKS chunks, under the response size limit, which concatenated form a
+single .csv.gz file (gzip members can be concatenated). The file is
+aggregated locally with tools/analytics.py instead of querying the live
+endpoints. Once a kind is exported, the chunks of the runs before the last
+RUNS_KEPT ones are deleted."""
+
+import csv
+import datetime
+import gzip
+import io
+
+from google.appengine.ext import ndb
+
+from models import User, Game, ArchivedGame, Score
+
+EXPORT_BATCH_SIZE = 500
+# Chunks served by one download request
+PART_CHUNKS = 200
+# Exports of a kind kept in the datastore
+RUNS_KEPT = 2
+DELETE_BATCH_SIZE = 500
+
+# Columns of the rows exported for each kind, in order
+COLUMNS = {
+    'Score': ('user_name', 'date', 'won', 'guesses'),
+    'Game': ('user_name', 'word', 'word_length', 'attempts_allowed',
+             'attempts_remaining', 'moves', 'game_over', 'won'),
+    'User': ('name', 'wins', 'total_games_played', 'active_games'),
+}
+# The summaries of the archived games have the columns of the games
+COLUMNS['ArchivedGame'] = COLUMNS['Game']
+MODELS = {'Score': Score, 'Game': Game, 'ArchivedGame': ArchivedGame,
+          'User': User}
+
+
+class ExportChunk(ndb.Model):
+    """One page of the rows of a kind exported by the run 'run'"""
+    run = ndb.StringProperty(required=True)
+    kind = ndb.StringProperty(required=True)
+    sequence = ndb.IntegerProperty(required=True)
+    rows = ndb.IntegerProperty(default=0, indexed=False)
+    # Gzipped CSV of the rows, without the header
+    data = ndb.BlobProperty(required=True)
+
+
+def new_run_id():
+    """Returns the id of a new export run, sortable by start time"""
+    return datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')
+
+
+def _encode(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def to_row(kind, entity):
+    """Returns the tuple of the values of the COLUMNS of an entity"""
+    if kind == 'Score':
+        row = (entity.user_name, entity.date.isoformat(), entity.won,
+               entity.guesses)
+    elif kind == 'Game':
+        row = (entity.user_name, entity.word_to_guess,
+               len(entity.word_to_guess), entity.attempts_allowed,
+               entity.attempts_remaining, len(entity.get_moves()),
+               entity.game_over, entity.is_won())
+    elif kind == 'ArchivedGame':
+        row = (entity.user_name, entity.word, len(entity.word),
+               entity.attempts_allowed, entity.attempts_remaining,
+               entity.moves, True, entity.won)
+    else:
+        row = (entity.name, entity.wins, entity.total_games_played,
+               entity.active_games)
+    return tuple(_encode(value) for value in row)
+
+
+def to_csv_gz(rows, header=None):
+    """Returns the rows, preceded by the header if any, as gzipped CSV"""
+    text = io.BytesIO()
+    writer = csv.writer(text, lineterminator='\n')
+    if header:
+        writer.writerow(header)
+    writer.writerows(rows)
+    data = io.BytesIO()
+    with gzip.GzipFile(fileobj=data, mode='wb') as out:
+        out.write(text.getvalue())
+    return data.getvalue()
+
+
+def export_page(run, kind, sequence, cursor=None):
+    """Stores one page of the entities of a kind as the ExportChunk number
+    'sequence' of the run. Returns the cursor of the next page, or None if
+    it was the last page"""
+    entities, cursor, more = MODELS[kind].query().fetch_page(
+        EXPORT_BATCH_SIZE, start_cursor=cursor)
+    rows = [to_row(kind, entity) for entity in entities]
+    # The id makes a retried task overwrite its chunk instead of adding one
+    ExportChunk(id='{}:{}:{:06d}'.format(run, kind, sequence), run=run,
+                kind=kind, sequence=sequence, rows=len(rows),
+                data=to_csv_gz(rows)).put()
+    return cursor if more and cursor else None
+
+
+def count_parts(run, kind):
+    """Returns the number of download parts of a kind exported by a run"""
+    chunks = ExportChunk.query(ExportChunk.run == run,
+                               ExportChunk.kind == kind).count(keys_only=True)
+    return (chunks + PART_CHUNKS - 1) // PART_CHUNKS
+
+
+def iter_part(run, kind, part):
+    """Yields the gzipped chunks of the rows of a part of a kind exported
+    by a run, in order, preceded in the first part by the gzipped header"""
+    if part == 0:
+        yield to_csv_gz([], COLUMNS[kind])
+    query = ExportChunk.query(ExportChunk.run == run,
+                              ExportChunk.kind == kind,
+                              ExportChunk.sequence >= part * PART_CHUNKS,
+                              ExportChunk.sequence < (part + 1) * PART_CHUNKS)
+    for chunk in query.order(ExportChunk.sequence).iter(batch_size=20):
+        yield chunk.data
+
+
+def delete_old_runs(kind):
+    """Deletes a batch of the chunks of a kind exported by the runs before
+    the last RUNS_KEPT ones. Returns True if there may be more to delete"""
+    firsts = ExportChunk.query(ExportChunk.kind == kind,
+                               ExportChunk.sequence == 0).order(
+                                   -ExportChunk.run).fetch(RUNS_KEPT)
+    if len(firsts) < RUNS_KEPT:
+        return False
+    keys = ExportChunk.query(ExportChunk.kind == kind,
+                             ExportChunk.run < firsts[-1].run).fetch(
+                                 DELETE_BATCH_SIZE, keys_only=True)
+    ndb.delete_multi(keys)
+    return len(keys) == DELETE_BATCH_SIZE
@@ -0,0 +1,49 @@
+"""gamecache.py - State of the games cached in memcache for 'get_game'. The
+state of a game is cached under its urlsafe key with the version of the game,
+which 'make_guess' bumps on every move, once the game is saved. A poll is then
+served by a single memcache get without parsing the key or reading the
+datastore, and a client sending the version it already has is told that the
+game is not modified."""
+
+import logging
+
+from google.appengine.api import memcache
+
+# Bump the version when the format of the cached state changes
+PREFIX = 'GAME_STATE:1:'
+TTL = 3600
+CAS_RETRIES = 3
+
+
+def get_state(urlsafe):
+    """Returns the cached state dict of a game, or None"""
+    return memcache.get(PREFIX + urlsafe)
+
+
+def set_state(urlsafe, state):
+    """Caches the state dict of a game unless the cached state has the same
+    or a newer version, using compare-and-set so that a slower request
+    cannot overwrite a newer state"""
+    key = PREFIX + urlsafe
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        cached = client.gets(key)
+        if cached is None:
+            if client.add(key, state, time=TTL):
+                return
+        elif cached['version'] >= state['version']:
+            return
+        elif client.cas(key, state, time=TTL):
+            return
+    logging.warning('Caching the state of game %s failed', urlsafe)
+    memcache.delete(key)
+
+
+def delete_state(urlsafe):
+    """Drops the cached state of a game that no longer exists"""
+    memcache.delete(PREFIX + urlsafe)
+
+
+def delete_states(urlsafes):
+    """Drops the cached states of games that no longer exist"""
+    memcache.delete_multi(urlsafes, key_prefix=PREFIX)
@@ -0,0 +1,84 @@
+"""highscores.py - High score board kept in memcache. The board holds the
+BOARD_SIZE best wins as (guesses, date, user_name) entries, fewest guesses
+first, so 'get_high_scores' is served by a single memcache get. 'end_game'
+inserts a win in place when it beats the board's cutoff, using
+compare-and-set so that concurrent wins are not lost. On a miss the board is
+rebuilt from the datastore. A win recorded while no board is cached bumps a
+generation counter, so that a board rebuilt concurrently by a query that did
+not see the win is rebuilt again on the next read. As the query is only
+eventually consistent, boards also expire after BOARD_TTL."""
+
+import bisect
+import logging
+
+from google.appengine.api import memcache
+
+from Score import Score, ScoreForm, ScoreForms
+from utils import get_user_names
+
+BOARD_SIZE = 100
+# Bump the version when the format of the entries changes
+BOARD_KEY = 'HIGH_SCORES:2'
+GENERATION_KEY = 'HIGH_SCORES_GENERATION'
+BOARD_TTL = 600
+CAS_RETRIES = 3
+
+
+def _to_score_forms(entries):
+    return ScoreForms(items=[ScoreForm(user_name=user_name, date=date, won=True,
+                                       guesses=guesses)
+                             for guesses, date, user_name in entries])
+
+
+def _rebuild(generation, stale):
+    """Builds the board from the datastore and caches it with the generation
+    read before the query. A missing board is only added, so that a board
+    cached meanwhile is kept"""
+    scores = Score.query(Score.won == True).order(Score.guesses).fetch(BOARD_SIZE)
+    names = get_user_names(scores)
+    entries = [(score.guesses, str(score.date), names.get(score.user, ''))
+               for score in scores]
+    if stale:
+        memcache.set(BOARD_KEY, (generation, entries), time=BOARD_TTL)
+    else:
+        memcache.add(BOARD_KEY, (generation, entries), time=BOARD_TTL)
+    return entries
+
+
+def get_high_scores(results):
+    """Returns a ScoreForms of the best 'results' wins, or None if the board
+    is too small to answer"""
+    if results is None or results > BOARD_SIZE:
+        return None
+    cached = memcache.get_multi([BOARD_KEY, GENERATION_KEY])
+    generation = cached.get(GENERATION_KEY, 0)
+    board = cached.get(BOARD_KEY)
+    if board is None or board[0] != generation:
+        entries = _rebuild(generation, board is not None)
+    else:
+        entries = board[1]
+    return _to_score_forms(entries[:max(results, 0)])
+
+
+def record_win(guesses, date, user_name):
+    """Inserts a win into the cached board if it makes the board. The board
+    is dropped if it cannot be updated, so the next read rebuilds it"""
+    client = memcache.Client()
+    entry = (guesses, str(date), user_name)
+    for _ in range(CAS_RETRIES):
+        board = client.gets(BOARD_KEY)
+        if board is None:
+            # Invalidate a board being rebuilt by a query that missed the
+            # win, the next read rebuilds the board with this win
+            memcache.incr(GENERATION_KEY, initial_value=0)
+            return
+        generation, entries = board
+        if len(entries) >= BOARD_SIZE and guesses >= entries[-1][0]:
+            return
+        # Insert after the wins with as many guesses
+        i = bisect.bisect_right([cached[0] for cached in entries], guesses)
+        entries = (entries[:i] + [entry] + entries[i:])[:BOARD_SIZE]
+        if client.cas(BOARD_KEY, (generation, entries), time=BOARD_TTL):
+            return
+    logging.warning('High score board contended, dropping it')
+    memcache.delete(BOARD_KEY)
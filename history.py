@@ -0,0 +1,76 @@
+"""history.py - Compact, append-only encoding of the moves of a game. A letter
+guess takes one byte: the position of the letter in the alphabet with the
+FOUND flag set if the letter is in the word. A word guess takes the WORD byte
+(with FOUND set if it is the right word), one length byte and the word."""
+
+import engine
+
+FOUND = 0x20
+WORD = 0x40
+LETTER_MASK = 0x1f
+
+# Results of a move as shown in the history
+LETTER_FOUND = 'found'
+LETTER_MISSED = 'not in word'
+WORD_RIGHT = 'correct word'
+WORD_WRONG = 'wrong word'
+INVALID = 'invalid guess'
+REPEATED = 'repeated letter'
+
+_OUTCOME_RESULTS = {
+    engine.HIT: LETTER_FOUND,
+    engine.MISS: LETTER_MISSED,
+    engine.WORD_RIGHT: WORD_RIGHT,
+    engine.WORD_WRONG: WORD_WRONG,
+    engine.INVALID: INVALID,
+    engine.REPEATED: REPEATED,
+}
+
+
+def describe_outcome(outcome):
+    """Returns the result shown for an engine outcome"""
+    return _OUTCOME_RESULTS[outcome]
+
+
+def encode_move(guess, outcome):
+    """Returns the bytes of a move given its guess and its engine outcome"""
+    if outcome in (engine.HIT, engine.MISS):
+        code = ord(guess) - 97
+        if outcome == engine.HIT:
+            code |= FOUND
+        return chr(code)
+    code = WORD | FOUND if outcome == engine.WORD_RIGHT else WORD
+    return chr(code) + chr(len(guess)) + guess
+
+
+def decode_moves(data):
+    """Returns the list of (guess, result) tuples of encoded moves"""
+    moves = []
+    i = 0
+    while i < len(data):
+        code = ord(data[i])
+        if code & WORD:
+            length = ord(data[i + 1])
+            guess = data[i + 2:i + 2 + length]
+            moves.append((guess, WORD_RIGHT if code & FOUND else WORD_WRONG))
+            i += 2 + length
+        else:
+            moves.append((engine.ALPHABET[code & LETTER_MASK],
+                          LETTER_FOUND if code & FOUND else LETTER_MISSED))
+            i += 1
+    return moves
+
+
+def parse_legacy(entries):
+    """Returns the list of (guess, result) tuples of the English sentences
+    stored by games created before the encoding existed"""
+    moves = []
+    for entry in entries:
+        for suffix, result in ((' is the correct word', WORD_RIGHT),
+                               ('is the wrong word', WORD_WRONG),
+                               (' is not in word', LETTER_MISSED),
+                               (' found', LETTER_FOUND)):
+            if entry.endswith(suffix):
+                moves.append((entry[:-len(suffix)].strip(), result))
+                break
+    return moves
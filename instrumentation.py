@@ -0,0 +1,108 @@
+"""instrumentation.py - Per-request RPC and latency instrumentation of the
+Endpoints methods. The 'instrumented' decorator times a sampled fraction of
+the calls of a method; while such a call runs, apiproxy hooks count its
+datastore and memcache RPCs, memcache hits and misses and the entity bytes
+read and written. Each sampled call is logged as one JSON line and added to
+counters in memcache, which 'get_stats' reads back aggregated per method."""
+
+import functools
+import json
+import logging
+import random
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+from settings import STATS_SAMPLE_RATE
+
+FIELDS = ('calls', 'wall_us', 'datastore_get', 'datastore_put',
+          'datastore_query', 'datastore_delete', 'memcache_hit',
+          'memcache_miss', 'bytes_read', 'bytes_written')
+MEMCACHE_PREFIX = 'STATS:'
+
+# Names of the instrumented methods, in definition order
+METHODS = []
+_local = threading.local()
+
+
+def _pre_call(service, call, request, response):
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        return
+    if service == 'datastore_v3':
+        if call == 'Get':
+            stats['datastore_get'] += 1
+        elif call == 'Put':
+            stats['datastore_put'] += 1
+            stats['bytes_written'] += request.ByteSize()
+        elif call == 'RunQuery':
+            stats['datastore_query'] += 1
+        elif call == 'Delete':
+            stats['datastore_delete'] += 1
+
+
+def _post_call(service, call, request, response, rpc=None, error=None):
+    stats = getattr(_local, 'stats', None)
+    if stats is None or error is not None:
+        return
+    if service == 'datastore_v3' and call in ('Get', 'RunQuery', 'Next'):
+        stats['bytes_read'] += response.ByteSize()
+    elif service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        stats['memcache_hit'] += hits
+        stats['memcache_miss'] += request.key_size() - hits
+
+
+def install_hooks():
+    """Installs the apiproxy hooks, once per instance"""
+    apiproxy = apiproxy_stub_map.apiproxy
+    apiproxy.GetPreCallHooks().Append('instrumentation', _pre_call)
+    apiproxy.GetPostCallHooks().Append('instrumentation', _post_call)
+
+install_hooks()
+
+
+def _flush(name, stats):
+    logging.info('endpoint_stats %s', json.dumps(dict(stats, method=name),
+                                                   sort_keys=True))
+    memcache.offset_multi(dict((field, value) for field, value in stats.items()
+                               if value),
+                          key_prefix='{}{}:'.format(MEMCACHE_PREFIX, name),
+                          initial_value=0)
+
+
+def instrumented(method):
+    """Decorator of the HangmanApi methods, applied below endpoints.method"""
+    METHODS.append(method.__name__)
+
+    @functools.wraps(method)
+    def wrapper(self, request):
+        if getattr(_local, 'stats', None) is not None or \
+                random.random() >= STATS_SAMPLE_RATE:
+            return method(self, request)
+        stats = dict.fromkeys(FIELDS, 0)
+        stats['calls'] = 1
+        _local.stats = stats
+        start = time.time()
+        try:
+            return method(self, request)
+        finally:
+            stats['wall_us'] = int((time.time() - start) * 1000000)
+            _local.stats = None
+            try:
+                _flush(method.__name__, stats)
+            except Exception:
+                logging.exception('Recording the stats of %s failed',
+                                  method.__name__)
+    return wrapper
+
+
+def get_stats():
+    """Returns a dict of method name to the dict of its aggregated counters"""
+    keys = ['{}:{}'.format(name, field) for name in METHODS for field in FIELDS]
+    values = memcache.get_multi(keys, key_prefix=MEMCACHE_PREFIX)
+    return dict((name, dict((field, int(values.get('{}:{}'.format(name, field), 0)))
+                            for field in FIELDS))
+                for name in METHODS)
@@ -1,45 +1,305 @@
 #!/usr/bin/env python
 
 """main.py - This file contains handlers that are called by taskqueue and/or
-cronjobs."""
+cronjobs, and the download of the analytics exports."""
+import datetime
 import logging
 
 import webapp2
 from google.appengine.api import mail, app_identity
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
 from application import HangmanApi
 
-from models import User, Game
+from models import User, UserName, Game, ArchivedGame, Score, ReminderRun, normalize_name
+from utils import get_user_names
+import export
+import gamecache
+from settings import ARCHIVE_AFTER_DAYS
+
+BACKFILL_BATCH_SIZE = 100
+ARCHIVE_BATCH_SIZE = 200
+REMINDER_BATCH_SIZE = 50
+# A reminder run not updated for this long is resumed by the next cron
+REMINDER_STALL_TIMEOUT = datetime.timedelta(hours=1)
 
 
 class SendReminderEmail(webapp2.RequestHandler):
     def get(self):
-        """Send a reminder email to each User with an email about games.
-        Called every hour using a cron job"""
+        """Start sending a reminder email to each User with an email about
+        games, or resume a run that stalled. Called every 12 hours using a
+        cron job"""
+        run = ReminderRun.query(ReminderRun.done == False).get()
+        if run is None:
+            run = ReminderRun()
+            run.put()
+        elif run.updated > datetime.datetime.utcnow() - REMINDER_STALL_TIMEOUT:
+            # The run is still in progress
+            return
+        taskqueue.add(url='/tasks/send_reminders',
+                      params={'run': run.key.id(), 'page': run.page})
+
+
+class SendReminderBatch(webapp2.RequestHandler):
+    def post(self):
+        """Send the reminder emails of one page of Users with active games.
+        The checkpoint is read again, checked and moved, and the task of the
+        next page is enqueued, in one transaction before the emails are sent,
+        so pages are processed in parallel and only one delivery of a task
+        sends its page"""
+        run = ReminderRun.get_by_id(int(self.request.get('run')))
+        page = int(self.request.get('page'))
+        if not run or run.done or run.page != page:
+            # Duplicate or stale task
+            return
+        query = User.query(User.active_games > 0)
+        users, cursor, more = query.fetch_page(
+            REMINDER_BATCH_SIZE, start_cursor=Cursor(urlsafe=run.cursor or None))
+        done = not (more and cursor)
+
+        @ndb.transactional
+        def checkpoint():
+            # Read again so that only one delivery of the task moves the
+            # checkpoint past the page
+            stored = run.key.get()
+            if stored.done or stored.page != page:
+                return False
+            stored.page = page + 1
+            stored.done = done
+            stored.cursor = cursor.urlsafe() if cursor else None
+            stored.put()
+            if not done:
+                taskqueue.add(url='/tasks/send_reminders', transactional=True,
+                              params={'run': run.key.id(), 'page': page + 1})
+            return True
+        if not checkpoint():
+            # Another delivery of the task sent this page
+            return
+
         app_id = app_identity.get_application_id()
-        users = User.query(User.email != None)
+        subject = 'This is a reminder!'
         for user in users:
-            games = Game.query(Game.user == user.key).\
-            filter(Game.game_over == False)
-            if games.count() > 0:
-                subject = 'This is a reminder!'
-                body = 'Hello {}, remember you have unfinished games !'.format(user.name)
-                # This will send test emails, the arguments to send_mail are:
-                # from, to, subject, body
-                mail.send_mail('noreply@{}.appspotmail.com'.
-                    format(app_id),
-                           user.email,
-                           subject,
-                           body)
+            if not user.email:
+                continue
+            body = 'Hello {}, remember you have unfinished games !'.format(user.name)
+            # This will send test emails, the arguments to send_mail are:
+            # from, to, subject, body
+            try:
+                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
+                               user.email,
+                               subject,
+                               body)
+            except Exception:
+                logging.exception('Reminder to %s failed', user.email)
 
 
 class UpdateAverageMovesRemaining(webapp2.RequestHandler):
+    def get(self):
+        """Reconcile the active games aggregate. Called every day using a
+        cron job"""
+        HangmanApi._reconcile_average_attempts()
+        self.response.set_status(204)
+
+    def post(self):
+        """Reconcile the active games aggregate."""
+        HangmanApi._reconcile_average_attempts()
+        self.response.set_status(204)
+
+
+class Backfill(webapp2.RequestHandler):
+    def get(self):
+        """Start updating the existing entities: copy the user names onto
+        the Scores and Games, date the finished Games, save the Users again to store their computed
+        ranking properties with their count of active games and create
+        their UserName mappings"""
+        for kind in ('Score', 'Game', 'User'):
+            taskqueue.add(url='/tasks/backfill', params={'kind': kind})
+        self.response.set_status(202)
+
+    def post(self):
+        """Update one page of entities of a kind and chain a task for the
+        next page. The Users and Games are read again and updated one by one
+        in transactions, so that a concurrent move or end of game is not
+        overwritten. Nothing else writes the Scores once created"""
+        kind = self.request.get('kind')
+        model = {'Score': Score, 'Game': Game, 'User': User}[kind]
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        entities, cursor, more = model.query().fetch_page(BACKFILL_BATCH_SIZE,
+                                                          start_cursor=cursor)
+        if model is User:
+            counts = [Game.query(Game.user == user.key, Game.game_over == False).
+                      count_async(keys_only=True) for user in entities]
+            futures = [_backfill_user_async(user.key, count.get_result())
+                       for user, count in zip(entities, counts)]
+        else:
+            names = get_user_names(entities)
+            if model is Game:
+                futures = [_backfill_game_async(game.key, names) for game in entities]
+            else:
+                changed = [score for score in entities if not score.user_name and
+                           score.user in names]
+                for score in changed:
+                    score.user_name = names[score.user]
+                futures = [ndb.put_multi_async(changed)]
+        for future in futures:
+            future.get_result()
+        if more and cursor:
+            taskqueue.add(url='/tasks/backfill',
+                          params={'kind': kind, 'cursor': cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+@ndb.tasklet
+def _backfill_user_async(key, active_games):
+    """Saves a User again with its UserName mapping. active_games, counted by
+    an eventually consistent query, is only stored for a User saved before
+    the count existed: the count stored since is kept up to date by the
+    games"""
+    @ndb.tasklet
+    def txn():
+        user = yield key.get_async()
+        if not user:
+            return
+        mapping_key = ndb.Key(UserName, normalize_name(user.name))
+        mapping = yield mapping_key.get_async()
+        if not User.active_games._has_value(user):
+            user.active_games = active_games
+        entities = [user]
+        if not mapping:
+            entities.append(UserName(key=mapping_key, user=key))
+        yield ndb.put_multi_async(entities)
+    yield ndb.transaction_async(txn, xg=True)
+
+
+@ndb.tasklet
+def _backfill_game_async(key, names):
+    """Copies the user name onto a Game and dates it if it ended before the
+    end date was stored. names maps the User keys to their names"""
+    @ndb.tasklet
+    def txn():
+        game = yield key.get_async()
+        if not game:
+            return
+        changed = False
+        if not game.user_name and game.user in names:
+            game.user_name = names[game.user]
+            changed = True
+        if game.game_over and not game.ended:
+            # Games that ended before the end date was stored are archived
+            # from now on
+            game.ended = datetime.datetime.utcnow()
+            changed = True
+        if changed:
+            yield game.put_async()
+    yield ndb.transaction_async(txn)
+
+
+class ArchiveGames(webapp2.RequestHandler):
+    def get(self):
+        """Start archiving the games that ended more than ARCHIVE_AFTER_DAYS
+        days ago. Called every day using a cron job"""
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)
+        taskqueue.add(url='/tasks/archive_games',
+                      params={'cutoff': cutoff.strftime('%Y-%m-%dT%H:%M:%S')})
+        self.response.set_status(202)
+
     def post(self):
-        """Update game listing announcement in memcache."""
-        HangmanApi._cache_average_attempts()
+        """Replace one batch of finished games by their ArchivedGame
+        summaries and chain a task for the next batch. The Scores are kept.
+        The summaries have the ids of the games, so a retried task writes
+        the same summaries again"""
+        cutoff = datetime.datetime.strptime(self.request.get('cutoff'),
+                                            '%Y-%m-%dT%H:%M:%S')
+        games = Game.query(Game.game_over == True,
+                           Game.ended < cutoff).fetch(ARCHIVE_BATCH_SIZE)
+        if games:
+            ndb.put_multi([ArchivedGame.from_game(game) for game in games])
+            ndb.delete_multi([game.key for game in games])
+            gamecache.delete_states([game.key.urlsafe() for game in games])
+            logging.info('Archived %d games', len(games))
+        if len(games) == ARCHIVE_BATCH_SIZE:
+            # The archived games are gone from the query, so no cursor
+            taskqueue.add(url='/tasks/archive_games',
+                          params={'cutoff': self.request.get('cutoff')})
         self.response.set_status(204)
 
 
+class StartExport(webapp2.RequestHandler):
+    def get(self):
+        """Start exporting the Scores, Games and Users for analytics, one
+        task chain per kind. Called every week using a cron job"""
+        run = export.new_run_id()
+        for kind in sorted(export.MODELS):
+            taskqueue.add(url='/tasks/export',
+                          params={'run': run, 'kind': kind, 'sequence': 0})
+        logging.info('Started export %s', run)
+        self.response.set_status(202)
+        self.response.write(run)
+
+
+class ExportBatch(webapp2.RequestHandler):
+    def post(self):
+        """Export one page of entities of a kind and chain a task for the
+        next page"""
+        run = self.request.get('run')
+        kind = self.request.get('kind')
+        sequence = int(self.request.get('sequence'))
+        cursor = export.export_page(
+            run, kind, sequence,
+            Cursor(urlsafe=self.request.get('cursor') or None))
+        if cursor:
+            taskqueue.add(url='/tasks/export',
+                          params={'run': run, 'kind': kind,
+                                  'sequence': sequence + 1,
+                                  'cursor': cursor.urlsafe()})
+        else:
+            logging.info('Export %s of %s done in %d chunks', run, kind,
+                         sequence + 1)
+            taskqueue.add(url='/tasks/purge_exports', params={'kind': kind})
+        self.response.set_status(204)
+
+
+class PurgeExports(webapp2.RequestHandler):
+    def post(self):
+        """Delete a batch of the chunks of the older exports of a kind and
+        chain a task for the next batch"""
+        kind = self.request.get('kind')
+        if export.delete_old_runs(kind):
+            taskqueue.add(url='/tasks/purge_exports', params={'kind': kind})
+        self.response.set_status(204)
+
+
+class DownloadExport(webapp2.RequestHandler):
+    def get(self, run, kind):
+        """Download one part of the rows of a kind exported by a run. The
+        response is buffered, so an export is served in parts of
+        export.PART_CHUNKS chunks; the X-Export-Parts header gives the number
+        of parts and their concatenation is the .csv.gz file"""
+        if kind not in export.MODELS:
+            self.abort(404)
+        part = int(self.request.get('part') or 0)
+        parts = export.count_parts(run, kind)
+        if not 0 <= part < max(parts, 1):
+            self.abort(404)
+        self.response.headers['Content-Type'] = 'application/gzip'
+        self.response.headers['X-Export-Parts'] = str(parts)
+        self.response.headers['Content-Disposition'] = \
+            'attachment; filename={}-{}.csv.gz.{:03d}'.format(kind, run, part)
+        for data in export.iter_part(run, kind, part):
+            self.response.write(data)
+
+
 app = webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
+    ('/tasks/send_reminders', SendReminderBatch),
     ('/tasks/cache_average_attempts', UpdateAverageMovesRemaining),
+    ('/crons/reconcile_average_attempts', UpdateAverageMovesRemaining),
+    ('/tasks/backfill', Backfill),
+    ('/crons/archive_games', ArchiveGames),
+    ('/tasks/archive_games', ArchiveGames),
+    ('/crons/export', StartExport),
+    ('/tasks/export', ExportBatch),
+    ('/tasks/purge_exports', PurgeExports),
+    (r'/exports/(\d+)/(\w+)\.csv\.gz', DownloadExport),
 ], debug=True)
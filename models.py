@@ -1,6 +1,7 @@
 """models.py - This file contains all the entities used in this project, 
 namely User, Game and Score and also all the forms."""
 
+from google.appengine.ext import ndb
 from User import *
 from Game import *
 from Score import *
@@ -8,12 +9,84 @@ from Score import *
 class NewGameForm(messages.Message):
     """Form used to create a new game"""
     user_name = messages.StringField(1, required=True)
+    min_length = messages.IntegerField(2)
+    max_length = messages.IntegerField(3)
+    # 0 for easy, 1 for medium and 2 for hard words
+    difficulty = messages.IntegerField(4)
     
+class NewGamesForm(messages.Message):
+    """Form used to create one game for each user name of the list"""
+    user_names = messages.StringField(1, repeated=True)
+    min_length = messages.IntegerField(2)
+    max_length = messages.IntegerField(3)
+    difficulty = messages.IntegerField(4)
+
+class NewGamesResultForm(messages.Message):
+    """Keys of the games created, in order, and the unknown user names"""
+    urlsafe_keys = messages.StringField(1, repeated=True)
+    missing_users = messages.StringField(2, repeated=True)
+
+class NewUserForm(messages.Message):
+    """Form used to create a user"""
+    user_name = messages.StringField(1, required=True)
+    email = messages.StringField(2)
+
+class NewUsersForm(messages.Message):
+    """Form used to create several users"""
+    users = messages.MessageField(NewUserForm, 1, repeated=True)
+
+class NewUsersResultForm(messages.Message):
+    """Names of the users created, of the ones already taken and of the
+    invalid ones"""
+    created = messages.StringField(1, repeated=True)
+    existing = messages.StringField(2, repeated=True)
+    invalid = messages.StringField(3, repeated=True)
+
 class MakeMoveForm(messages.Message):
     """Form used to make a move in an existing game"""
     guess = messages.StringField(1, required=True)
 
+class MakeMovesForm(messages.Message):
+    """Form used to make several moves in an existing game"""
+    guesses = messages.StringField(1, repeated=True)
+
+class MovesForm(messages.Message):
+    """Result of every move applied and the game state after them"""
+    moves = messages.MessageField(MoveForm, 1, repeated=True)
+    game = messages.MessageField(GameForm, 2, required=True)
+
+class HintForm(messages.Message):
+    """Next guess suggested by the solver and the number of words of the
+    library still matching the game"""
+    guess = messages.StringField(1)
+    candidates = messages.IntegerField(2)
+
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     message = messages.StringField(1, required=True)
 
+class MethodStatsForm(messages.Message):
+    """Counters of the sampled calls of an Endpoints method"""
+    method = messages.StringField(1, required=True)
+    calls = messages.IntegerField(2, required=True)
+    average_ms = messages.FloatField(3, required=True)
+    datastore_get = messages.IntegerField(4, required=True)
+    datastore_put = messages.IntegerField(5, required=True)
+    datastore_query = messages.IntegerField(6, required=True)
+    datastore_delete = messages.IntegerField(7, required=True)
+    memcache_hit = messages.IntegerField(8, required=True)
+    memcache_miss = messages.IntegerField(9, required=True)
+    bytes_read = messages.IntegerField(10, required=True)
+    bytes_written = messages.IntegerField(11, required=True)
+
+class StatsForms(messages.Message):
+    """Return the counters of every method"""
+    items = messages.MessageField(MethodStatsForm, 1, repeated=True)
+
+class ReminderRun(ndb.Model):
+    """Checkpoint of a run of the reminder emails cron"""
+    cursor = ndb.StringProperty(indexed=False)
+    page = ndb.IntegerProperty(default=0, indexed=False)
+    done = ndb.BooleanProperty(default=False)
+    started = ndb.DateTimeProperty(auto_now_add=True)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
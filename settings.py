@@ -10,3 +10,16 @@ WEB_CLIENT_ID = '466361356498-g3ugr4sqeg3tsk38t7u3keke1po512ip.apps.googleuserco
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Dictionary of the words to guess, relative to the application directory.
+# Either a plain text file with one word per line or a file packed with
+# 'python words.py pack'. The six demo words are used if it does not exist.
+WORDS_FILE = 'words.bin'
+
+# Fraction of the Endpoints calls whose RPCs and latency are recorded by
+# instrumentation.py
+STATS_SAMPLE_RATE = 0.1
+
+# Finished games are replaced by an ArchivedGame summary this many days after
+# they ended
+ARCHIVE_AFTER_DAYS = 30
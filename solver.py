@@ -0,0 +1,248 @@
+"""solver.py - Hangman solver behind 'get_hint' and 'auto_play'. The words of
+the library are grouped by length into tables holding the words packed in one
+string and, for every letter, an array of the positions mask of the letter in
+each word. Each state of a game is a node of a decision tree: the array of
+the candidate words consistent with the letters guessed so far. Guessing a
+letter partitions the candidates of a node by the positions of the letter and
+every part becomes a child node, so the tree is built incrementally as letters
+are guessed and a path already walked is replayed with one dict lookup per
+guess. The trees are dropped once their estimated size reaches
+TREE_CACHE_BYTES. The solver guesses the letter found in the most candidates,
+breaking ties by the number of parts, and the word itself once a single
+candidate is left."""
+
+import threading
+from array import array
+from operator import itemgetter
+
+import engine
+from words import get_library
+
+# Guessed in this order when the word is not in the library
+FALLBACK_ORDER = 'etaoinshrdlcumwfgypbvkjxqz'
+# Estimated size of the tree nodes kept in memory before the trees are reset
+TREE_CACHE_BYTES = 32 << 20
+# Estimated size of a node and its entry in the parent, without the candidates
+NODE_BYTES = 384
+# Array type of the candidate word numbers of a node
+CANDIDATE_TYPE = 'i'
+
+
+def _mask_type(length):
+    """Returns the smallest array type holding the positions masks of words
+    of a length, or None for words too long for any"""
+    for code, bits in (('B', 8), ('H', 16), ('i', 31), ('l', 63)):
+        if length <= bits and array(code).itemsize * 8 >= bits:
+            return code
+    return None
+
+
+def _values(column, candidates):
+    """Returns the tuple of the values of a column for the candidates"""
+    if len(candidates) == 1:
+        return (column[candidates[0]],)
+    return itemgetter(*candidates)(column)
+
+
+class Node(object):
+    """The candidate words of a state and the partitions already computed"""
+    __slots__ = ('table', 'candidates', 'guessed', 'best', 'children')
+
+    def __init__(self, table, candidates, guessed):
+        self.table = table
+        self.candidates = candidates
+        self.guessed = guessed
+        self.best = None
+        # Letter index -> dict of positions mask -> child Node, created with
+        # the first child as most nodes are leaves
+        self.children = None
+
+    def child(self, i, positions):
+        """Returns the node reached by guessing the letter of index i when it
+        is found at the positions mask, or None if no candidate matches"""
+        children = self.children.get(i) if self.children else None
+        if children is None:
+            parts = {}
+            for w, mask in zip(self.candidates,
+                               _values(self.table.positions[i], self.candidates)):
+                parts.setdefault(mask, []).append(w)
+            guessed = self.guessed | 1 << i
+            children = dict((mask, Node(self.table, array(CANDIDATE_TYPE, words),
+                                        guessed))
+                            for mask, words in parts.items())
+            if self.children is None:
+                self.children = {}
+            self.children[i] = children
+            self.table.solver.count_nodes(len(children), len(self.candidates))
+        return children.get(positions)
+
+    def best_letter(self):
+        """Returns the index of the letter to guess, or None if no letter
+        left is in any candidate"""
+        if self.best is None:
+            guessed = self.guessed
+            positions = self.table.positions
+            if guessed:
+                counts = [0] * 26
+                total = len(self.candidates)
+                for i in range(26):
+                    if not guessed >> i & 1:
+                        counts[i] = total - _values(positions[i],
+                                                    self.candidates).count(0)
+            else:
+                counts = self.table.frequency
+            top = max([count for i, count in enumerate(counts)
+                       if not guessed >> i & 1] or [0])
+            tied = [i for i, count in enumerate(counts)
+                    if count == top and not guessed >> i & 1]
+            if not top:
+                self.best = -1
+            elif len(tied) == 1:
+                self.best = tied[0]
+            else:
+                # The letter splitting the candidates in the most parts
+                self.best = max(tied, key=lambda i: len(set(
+                    _values(positions[i], self.candidates))))
+        return self.best if self.best >= 0 else None
+
+    def next_guess(self):
+        """Returns the guess to make: the word if a single candidate is left,
+        otherwise the best letter. None if there is nothing left to guess"""
+        if len(self.candidates) == 1:
+            return self.table.word(self.candidates[0])
+        i = self.best_letter()
+        return engine.ALPHABET[i] if i is not None else None
+
+
+class Table(object):
+    """The words of one length packed in one string, the array of the
+    positions mask of every letter in each word and the number of words
+    containing each letter"""
+
+    def __init__(self, solver, length, words):
+        self.solver = solver
+        self.length = length
+        self.data = ''.join(words)
+        count = len(words)
+        code = _mask_type(length)
+        if code:
+            self.positions = [array(code, [0]) * count for _ in range(26)]
+        else:
+            self.positions = [[0] * count for _ in range(26)]
+        for w, word in enumerate(words):
+            for i, char in enumerate(word):
+                self.positions[ord(char) - 97][w] |= 1 << i
+        self.frequency = [count - column.count(0) for column in self.positions]
+        self.root = Node(self, array(CANDIDATE_TYPE, range(count)), 0)
+
+    def word(self, w):
+        """Returns the word number w"""
+        return self.data[w * self.length:(w + 1) * self.length]
+
+
+class Solver(object):
+    """Decision trees of the words of a WordLibrary, one per word length,
+    built on first use"""
+
+    def __init__(self, library):
+        self.library = library
+        self.tables = {}
+        self.tree_bytes = 0
+        self.lock = threading.Lock()
+
+    def table(self, length):
+        """Returns the Table of the words of a length"""
+        table = self.tables.get(length)
+        if table is None:
+            with self.lock:
+                table = self.tables.get(length)
+                if table is None:
+                    words = []
+                    for bucket in self.library.select(length, length):
+                        words.extend(self.library.words(bucket))
+                    table = Table(self, length, words)
+                    self.tables[length] = table
+        return table
+
+    def count_nodes(self, nodes, candidates):
+        """Counts new tree nodes holding the candidates of their parent and
+        drops the trees when they are too large. The tables themselves are
+        kept"""
+        self.tree_bytes += (nodes * NODE_BYTES +
+                            candidates * array(CANDIDATE_TYPE).itemsize)
+        if self.tree_bytes > TREE_CACHE_BYTES:
+            with self.lock:
+                for length, table in self.tables.items():
+                    table.root = Node(table, table.root.candidates, 0)
+                self.tree_bytes = 0
+
+    def node(self, word, letters_guessed):
+        """Returns the node of a game of the word after the letters guessed,
+        or None if the word is not in the library. Games created before the
+        guesses were lowercased can have uppercase letters guessed"""
+        index = engine.word_index(word)
+        node = self.table(len(word)).root
+        for letter in letters_guessed.lower():
+            i = ord(letter) - 97
+            if not 0 <= i < 26:
+                continue
+            node = node.child(i, index[i])
+            if node is None:
+                return None
+        return node
+
+    def hint(self, word, letters_guessed, words_guessed=()):
+        """Returns the best next guess of a game of the word after the
+        letters guessed and the number of candidate words left. Only the
+        positions of the letters guessed are used, as a player sees them.
+        The words already guessed, wrong since the game goes on, are never
+        suggested again: when the word is not in the library the last
+        candidate can be another word"""
+        letters_guessed = letters_guessed.lower()
+        node = self.node(word, letters_guessed)
+        if node is not None:
+            guess = node.next_guess()
+            if guess is not None and guess not in words_guessed:
+                return guess, len(node.candidates)
+        for letter in FALLBACK_ORDER:
+            if letter not in letters_guessed:
+                return letter, 0
+        return None, 0
+
+    def play(self, word, attempts=9):
+        """Plays a game of the word to the end with the solver's guesses.
+        Returns the HangmanEngine of the finished game and the guesses"""
+        state = engine.HangmanEngine(word, attempts_remaining=attempts)
+        node = self.table(len(word)).root
+        guesses = []
+        words_guessed = set()
+        while not state.over:
+            guess = node.next_guess() if node is not None else None
+            if guess is None:
+                guess, _ = self.hint(word, engine.mask_to_letters(state.guessed),
+                                     words_guessed)
+                if guess is None:
+                    break
+            guesses.append(guess)
+            if state.guess(guess) == engine.WORD_WRONG:
+                # The word is not in the library, guess the letters left
+                words_guessed.add(guess)
+                node = None
+            elif len(guess) == 1 and node is not None:
+                i = ord(guess) - 97
+                node = node.child(i, state.index[i])
+        return state, guesses
+
+
+_solver = None
+_lock = threading.Lock()
+
+
+def get_solver():
+    """Returns the Solver of the word library of this instance"""
+    global _solver
+    if _solver is None:
+        with _lock:
+            if _solver is None:
+                _solver = Solver(get_library())
+    return _solver
@@ -0,0 +1,2 @@
+"""tools - Scripts run locally against data exported by the application.
+Run them from the project root, e.g. 'python -m tools.analytics'."""
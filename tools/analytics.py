@@ -0,0 +1,125 @@
+"""analytics.py - Computes the game statistics from the files downloaded from
+/exports/<run>/<kind>.csv.gz, with NumPy instead of queries against the live
+application: the average number of moves per word, the win rate by word
+length and the games, win rate and average guesses of every user per month.
+Each file is loaded once into one array per column and cached next to it as
+a .npz file, so later runs skip the CSV parsing. Needs NumPy.
+Usage: python -m tools.analytics directory [user_name]"""
+
+import csv
+import glob
+import gzip
+import os
+import sys
+
+import numpy as np
+
+# Type of the columns written by export.py, the others are strings
+NUMERIC = {'won': np.int8, 'game_over': np.int8, 'guesses': np.int32,
+           'word_length': np.int32, 'attempts_allowed': np.int32,
+           'attempts_remaining': np.int32, 'moves': np.int32,
+           'wins': np.int32, 'total_games_played': np.int32,
+           'active_games': np.int32}
+
+
+def latest_export(directory, kind):
+    """Returns the path of the latest file of a kind in the directory"""
+    paths = sorted(glob.glob(os.path.join(directory, '{}-*.csv.gz'.format(kind))))
+    if not paths:
+        raise IOError('No {} export in {}'.format(kind, directory))
+    return paths[-1]
+
+
+def load(path):
+    """Returns a dict of column name to array of the rows of a .csv.gz file,
+    cached as a .npz file next to it"""
+    cached = path[:-len('.csv.gz')] + '.npz'
+    if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(path):
+        with np.load(cached) as data:
+            return dict(data)
+    with gzip.open(path, 'rb') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        values = list(zip(*reader)) or [()] * len(header)
+    columns = dict((name, np.array(column, dtype=NUMERIC.get(name, np.str_)))
+                   for name, column in zip(header, values))
+    np.savez_compressed(cached, **columns)
+    return columns
+
+
+def group_mean(keys, values):
+    """Returns the distinct keys, the count and the mean of the values of
+    each key"""
+    distinct, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(distinct))
+    sums = np.bincount(inverse, weights=values, minlength=len(distinct))
+    return distinct, counts, sums / np.maximum(counts, 1)
+
+
+def moves_per_word(games):
+    """Average number of moves of the finished games of each word"""
+    over = games['game_over'] == 1
+    return group_mean(games['word'][over], games['moves'][over])
+
+
+def win_rate_by_length(games):
+    """Win rate of the finished games by word length"""
+    over = games['game_over'] == 1
+    return group_mean(games['word_length'][over], games['won'][over])
+
+
+def user_trends(scores, user_name=None):
+    """Games, win rate and average guesses of the wins per user and month,
+    for one user or all of them"""
+    selected = np.ones(len(scores['user_name']), dtype=bool)
+    if user_name is not None:
+        selected = scores['user_name'] == user_name
+    users = scores['user_name'][selected]
+    months = np.array([date[:7] for date in scores['date'][selected]])
+    won = scores['won'][selected]
+    guesses = scores['guesses'][selected]
+    keys = np.array(['{}\t{}'.format(user, month)
+                     for user, month in zip(users, months)])
+    distinct, counts, win_rate = group_mean(keys, won)
+    win_keys, _, guesses_mean = group_mean(keys[won == 1], guesses[won == 1])
+    # Months without wins have no average guesses
+    average = dict(zip(win_keys, guesses_mean))
+    return [(key.split('\t')[0], key.split('\t')[1], count, rate,
+             average.get(key, float('nan')))
+            for key, count, rate in zip(distinct, counts, win_rate)]
+
+
+def concatenate(*tables):
+    """Returns the rows of tables with the same columns as one table"""
+    return dict((name, np.concatenate([table[name] for table in tables]))
+                for name in tables[0])
+
+
+def main(directory, user_name=None):
+    games = load(latest_export(directory, 'Game'))
+    # The archived games are exported separately with the same columns, if
+    # they were downloaded
+    try:
+        games = concatenate(games, load(latest_export(directory, 'ArchivedGame')))
+    except IOError:
+        pass
+    scores = load(latest_export(directory, 'Score'))
+    users = load(latest_export(directory, 'User'))
+
+    print('{} users, {} games, {} scores'.format(
+        len(users['name']), len(games['word']), len(scores['won'])))
+    print('\n{:<20} {:>7} {:>10}'.format('word', 'games', 'avg moves'))
+    for word, count, mean in zip(*moves_per_word(games)):
+        print('{:<20} {:>7} {:>10.2f}'.format(word, count, mean))
+    print('\n{:<12} {:>7} {:>9}'.format('word length', 'games', 'win rate'))
+    for length, count, rate in zip(*win_rate_by_length(games)):
+        print('{:<12} {:>7} {:>8.1f}%'.format(length, count, rate * 100))
+    print('\n{:<20} {:<8} {:>7} {:>9} {:>12}'.format(
+        'user', 'month', 'games', 'win rate', 'avg guesses'))
+    for user, month, count, rate, guesses in user_trends(scores, user_name):
+        print('{:<20} {:<8} {:>7} {:>8.1f}% {:>12.2f}'.format(
+            user, month, count, rate * 100, guesses))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
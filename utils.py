@@ -1,9 +1,14 @@
 """utils.py - File for collecting general utility functions."""
 
 import logging
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 import endpoints
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
 def get_by_urlsafe(urlsafe, model):
     """Returns an ndb.Model entity that the urlsafe key points to. Checks
         that the type of entity returned is of the correct kind. Raises an
@@ -33,3 +38,58 @@ def get_by_urlsafe(urlsafe, model):
     if not isinstance(entity, model):
         raise ValueError('Incorrect Kind')
     return entity
+
+
+
+def get_user_names(entities):
+    """Returns a dict mapping the user keys of the entities to the user names.
+    The names stored on the entities are used when present and the other
+    users are fetched with a single batch get.
+    Args:
+        entities: Entities with a 'user' key and a 'user_name' property
+    Returns:
+        A dict of user key to user name"""
+    names = {}
+    missing = set()
+    for entity in entities:
+        if entity.user_name:
+            names[entity.user] = entity.user_name
+        else:
+            missing.add(entity.user)
+    keys = list(missing.difference(names))
+    for key, user in zip(keys, ndb.get_multi(keys)):
+        if user:
+            names[key] = user.name
+    return names
+
+
+def fetch_page(query, page_size=None, cursor=None):
+    """Returns one page of the results of a query.
+    Args:
+        query: The ndb query
+        page_size: The number of results wanted, DEFAULT_PAGE_SIZE if None
+            and at most MAX_PAGE_SIZE
+        cursor: The urlsafe cursor returned with the previous page, if any
+    Returns:
+        The list of results and the urlsafe cursor of the next page, or None
+        if there are no more results.
+    Raises:
+        BadRequestException: if the page size or the cursor is invalid"""
+    page_size = min(page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    if page_size < 1:
+        raise endpoints.BadRequestException('Invalid page size')
+    try:
+        start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    except (datastore_errors.BadValueError, TypeError):
+        raise endpoints.BadRequestException('Invalid cursor')
+    results, next_cursor, more = query.fetch_page(page_size,
+                                                  start_cursor=start_cursor)
+    if more and next_cursor:
+        return results, next_cursor.urlsafe()
+    return results, None
+
+
+def chunks(items, size):
+    """Yields the successive slices of at most size items of a list"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -0,0 +1,167 @@
+"""words.py - Word library from which the word to guess is chosen. The library
+is loaded once per instance and kept packed: the words are sorted by length
+and difficulty and concatenated into a single string, so every bucket of
+words with the same length and difficulty is a contiguous run of fixed-size
+records. Picking a random word is therefore O(1) in the size of the
+dictionary. A packed file can be built offline with
+'python words.py pack words.txt words.bin' and is memory-mapped when the
+runtime allows it."""
+
+import os
+import random
+import sys
+import threading
+
+try:
+    import mmap
+except ImportError:  # mmap is not available in every sandbox
+    mmap = None
+
+from settings import WORDS_FILE
+
+MAGIC = 'HANGMAN-WORDS 1'
+# Used when no dictionary file is deployed
+DEFAULT_WORDS = ["beautiful", "extraordinary", "spectacular", "mountain",
+                 "fabulous", "wonderful"]
+
+# Difficulty buckets
+EASY = 0
+MEDIUM = 1
+HARD = 2
+RARE_LETTERS = frozenset('bfjkqvwxyz')
+
+
+def difficulty(word):
+    """Returns the difficulty bucket of a word. Rare letters and few distinct
+    letters make a word harder to guess"""
+    letters = set(word)
+    score = 2 * len(letters & RARE_LETTERS) + max(0, 8 - len(letters))
+    if score < 3:
+        return EASY
+    if score < 6:
+        return MEDIUM
+    return HARD
+
+
+class WordLibrary(object):
+    """Packed, bucketed word list"""
+
+    def __init__(self, data, buckets, base=0):
+        """data holds the packed words starting at offset base. buckets is a
+        list of (length, difficulty, offset, count) tuples"""
+        self.data = data
+        self.base = base
+        self.buckets = buckets
+        self.size = sum(bucket[3] for bucket in buckets)
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_words(cls, words):
+        """Builds a library from an iterable of words. Words are lowercased
+        and the ones containing other characters than letters are dropped"""
+        words = set(word.strip().lower() for word in words)
+        keyed = sorted((len(word), difficulty(word), word) for word in words
+                       if word and all('a' <= char <= 'z' for char in word))
+        buckets = []
+        chunks = []
+        offset = 0
+        for length, level, word in keyed:
+            if not buckets or buckets[-1][:2] != [length, level]:
+                buckets.append([length, level, offset, 0])
+            buckets[-1][3] += 1
+            chunks.append(word)
+            offset += length
+        return cls(''.join(chunks), [tuple(bucket) for bucket in buckets])
+
+    @classmethod
+    def load(cls, path):
+        """Loads a packed library file or a plain text file with one word per
+        line"""
+        with open(path, 'rb') as f:
+            if f.readline().rstrip('\n') != MAGIC:
+                f.seek(0)
+                return cls.from_words(f)
+            buckets = []
+            for _ in range(int(f.readline())):
+                buckets.append(tuple(int(value) for value in f.readline().split()))
+            base = f.tell()
+            data = None
+            if mmap is not None:
+                try:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (EnvironmentError, ValueError):
+                    data = None
+            if data is None:
+                data = f.read()
+                base = 0
+        return cls(data, buckets, base)
+
+    def pack(self, path):
+        """Writes the library to a packed file"""
+        with open(path, 'wb') as f:
+            f.write('{}\n{}\n'.format(MAGIC, len(self.buckets)))
+            for bucket in self.buckets:
+                f.write('{} {} {} {}\n'.format(*bucket))
+            f.write(self.data[self.base:self.base + sum(
+                length * count for length, _, _, count in self.buckets)])
+
+    def select(self, min_length=None, max_length=None, level=None):
+        """Returns the buckets matching the filters"""
+        return [bucket for bucket in self.buckets
+                if (min_length is None or bucket[0] >= min_length) and
+                (max_length is None or bucket[0] <= max_length) and
+                (level is None or bucket[1] == level)]
+
+    def word(self, bucket, i):
+        """Returns the i-th word of a bucket"""
+        length, _, offset, _ = bucket
+        start = self.base + offset + i * length
+        return self.data[start:start + length]
+
+    def words(self, bucket):
+        """Iterates over the words of a bucket"""
+        for i in range(bucket[3]):
+            yield self.word(bucket, i)
+
+    def random_word(self, min_length=None, max_length=None, level=None,
+                    rng=random):
+        """Returns a random word matching the filters. Raises ValueError if
+        no word matches"""
+        buckets = self.select(min_length, max_length, level)
+        total = sum(bucket[3] for bucket in buckets)
+        if not total:
+            raise ValueError('No word matches the requested length and difficulty')
+        i = rng.randrange(total)
+        for bucket in buckets:
+            if i < bucket[3]:
+                return self.word(bucket, i)
+            i -= bucket[3]
+
+
+_library = None
+_lock = threading.Lock()
+
+
+def get_library():
+    """Returns the word library of this instance, loading it on first use"""
+    global _library
+    if _library is None:
+        with _lock:
+            if _library is None:
+                path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    WORDS_FILE)
+                if os.path.exists(path):
+                    _library = WordLibrary.load(path)
+                else:
+                    _library = WordLibrary.from_words(DEFAULT_WORDS)
+    return _library
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'pack':
+        sys.exit('Usage: python words.py pack <words.txt> <words.bin>')
+    library = WordLibrary.load(sys.argv[2])
+    library.pack(sys.argv[3])
+    print('Packed {} words in {} buckets'.format(len(library), len(library.buckets)))